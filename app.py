@@ -1,32 +1,35 @@
 import os
 import base64
+import csv
 import io
 import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, date
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, Response, stream_with_context
 import mysql.connector
 from config import Config
-from models.face_recognition import detect_faces, nms_faces, extract_face, get_embedding, cosine_similarity
+from models.face_recognition import detect, nms, extract_face, get_embeddings, EMBEDDING_MODEL_VERSION, EMBEDDING_DIM
+from models.inference_pool import InferencePool
+from models.ann_index import IVFIndex
+from models.gallery import EmbeddingGallery, GalleryCache, encode_embedding
+from models.gallery_store import GalleryStore
+from utils.cache import ReportCache
+from utils.db import ConnectionPool, PoolTimeout
 from utils.image_processing import apply_clahe_filter, apply_bluish_filter_v2, apply_hist_eq_filter,apply_night_vision_filter, correct_orientation, apply_light_filter, apply_sharpening_filter, apply_bluish_filter,enhance_facial_features
 from PIL import Image
 import numpy as np
-import pandas as pd
+import xlsxwriter
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+from reportlab.pdfgen import canvas
 import cv2
-import concurrent.futures
 from werkzeug.utils import secure_filename
-import tensorflow as tf
-
-# Configure TensorFlow GPU memory growth
-gpus = tf.config.experimental.list_physical_devices('GPU')
-if gpus:
-    try:
-        for gpu in gpus:
-            tf.config.experimental.set_memory_growth(gpu, True)
-    except RuntimeError as e:
-        print(e)
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -35,18 +38,188 @@ app.secret_key = app.config['SECRET_KEY']
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+# Detection and embedding for attendance photos run in these worker processes.
+inference_pool = InferencePool(workers=app.config['INFERENCE_WORKERS'],
+                               queue_depth=app.config['INFERENCE_QUEUE_DEPTH'],
+                               warm=app.config['WARMUP_ON_STARTUP'],
+                               min_face_size=app.config['DETECTION_MIN_FACE_SIZE'] or None)
+
 # ================= Database Helper =================
+db_pool = ConnectionPool(
+    size=app.config['DB_POOL_SIZE'],
+    timeout=app.config['DB_POOL_TIMEOUT'],
+    health_check_interval=app.config['DB_HEALTH_CHECK_INTERVAL'],
+    host=app.config['MYSQL_HOST'],
+    user=app.config['MYSQL_USER'],
+    password=app.config['MYSQL_PASSWORD'],
+    database=app.config['MYSQL_DB']
+)
+
 class DatabaseHelper:
+    # Deadlock and lock wait timeout: the transaction was rolled back and can simply be re-run.
+    TRANSIENT_ERRNOS = (1213, 1205)
+
+    @staticmethod
+    def with_retry(fn, attempts=3):
+        """Run `fn()`, one whole transaction, again when MySQL reports a transient lock error."""
+        for attempt in range(attempts):
+            try:
+                return fn()
+            except mysql.connector.Error as e:
+                if e.errno not in DatabaseHelper.TRANSIENT_ERRNOS or attempt == attempts - 1:
+                    raise
+                time.sleep(0.05 * 2 ** attempt)
+
     @staticmethod
     def get_connection():
-        conn = mysql.connector.connect(
-            host=app.config['MYSQL_HOST'],
-            user=app.config['MYSQL_USER'],
-            password=app.config['MYSQL_PASSWORD'],
-            database=app.config['MYSQL_DB']
-        )
-        conn.autocommit = True
-        return conn
+        """
+        Check a connection out of the pool. close() returns it; prefer
+        `with DatabaseHelper.get_connection() as conn:` so every path does.
+        """
+        return db_pool.acquire()
+
+    @staticmethod
+    def scope_conditions(scope, alias="s"):
+        """SQL conditions and params restricting students to a (branch, class) scope; None matches everyone."""
+        conditions, params = [], []
+        if scope is not None:
+            for column, value in zip(("branch", "class"), scope):
+                if value is not None:
+                    conditions.append(f"{alias}.{column} = %s")
+                    params.append(value)
+        return conditions, params
+
+    @staticmethod
+    def load_gallery(scope=None):
+        conn = DatabaseHelper.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        conditions, params = DatabaseHelper.scope_conditions(scope)
+        query = ("SELECT f.student_id, f.embedding FROM student_faces f JOIN students s ON s.student_id = f.student_id "
+                 "WHERE f.model_version=%s AND f.embedding_dim=%s")
+        if conditions:
+            query += " AND " + " AND ".join(conditions)
+        cursor.execute(query, [EMBEDDING_MODEL_VERSION, EMBEDDING_DIM] + params)
+        gallery = EmbeddingGallery.from_rows(cursor.fetchall(), dim=EMBEDDING_DIM, index_factory=build_gallery_index,
+                                           shortlist=app.config['GALLERY_SHORTLIST'],
+                                           storage=app.config['GALLERY_STORAGE'])
+        cursor.close()
+        conn.close()
+        return gallery
+
+    @staticmethod
+    def load_gallery_rows():
+        """All current-model enrollment rows with the student's branch/class, for building the gallery store."""
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT f.student_id, s.branch, s.class, f.embedding FROM student_faces f "
+                           "JOIN students s ON s.student_id = f.student_id "
+                           "WHERE f.model_version=%s AND f.embedding_dim=%s", (EMBEDDING_MODEL_VERSION, EMBEDDING_DIM))
+            rows = cursor.fetchall()
+            cursor.close()
+        return rows
+
+class GalleryVersion:
+    """Enrollment version shared by every process through the single gallery_version row."""
+
+    @staticmethod
+    def current():
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM gallery_version WHERE id=1")
+            row = cursor.fetchone()
+            cursor.close()
+        return row[0] if row else 0
+
+    @staticmethod
+    def bump():
+        """Increment the version and return the new value."""
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO gallery_version (id, version) VALUES (1, LAST_INSERT_ID(1)) "
+                           "ON DUPLICATE KEY UPDATE version=LAST_INSERT_ID(version+1)")
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            version = cursor.fetchone()[0]
+            cursor.close()
+        return version
+
+class PaginationHelper:
+    """
+    Keyset pagination for admin listings. Pages are addressed by the key of
+    the last row shown (`?after=`), so each page is one index range scan no
+    matter how deep into the table it is.
+    """
+
+    @staticmethod
+    def args():
+        """Read (after, per_page) from the query string, clamping per_page."""
+        try:
+            per_page = int(request.args.get('per_page', app.config['PAGE_SIZE']))
+        except ValueError:
+            per_page = app.config['PAGE_SIZE']
+        per_page = max(1, min(per_page, app.config['MAX_PAGE_SIZE']))
+        return request.args.get('after') or None, per_page
+
+    @staticmethod
+    def fetch(cursor, table, key, conditions, params, descending=False, columns="*"):
+        """
+        Run the count query and fetch one page of `table` ordered by `key`.
+        `conditions`/`params` are the filters (SQL fragments with %s
+        placeholders). Returns (rows, pagination) where pagination holds the
+        total and the first/next page URLs for the template.
+        """
+        after, per_page = PaginationHelper.args()
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        cursor.execute(f"SELECT COUNT(*) AS total FROM {table}{where}", params)
+        total = cursor.fetchone()['total']
+        page_conditions, page_params = list(conditions), list(params)
+        if after is not None:
+            page_conditions.append(f"{key} {'<' if descending else '>'} %s")
+            page_params.append(after)
+        where = " WHERE " + " AND ".join(page_conditions) if page_conditions else ""
+        cursor.execute(f"SELECT {columns} FROM {table}{where} ORDER BY {key} {'DESC' if descending else 'ASC'} LIMIT %s",
+                       page_params + [per_page + 1])
+        rows = cursor.fetchall()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        link_args = {k: v for k, v in request.args.items() if k != 'after' and v}
+        pagination = {
+            'total': total,
+            'per_page': per_page,
+            'first_url': url_for(request.endpoint, **request.view_args, **link_args) if after is not None else None,
+            'next_url': url_for(request.endpoint, **request.view_args, **link_args, after=rows[-1][key]) if has_next else None,
+        }
+        return rows, pagination
+
+# Results of the attendance report queries, keyed by kind and normalized date/time range.
+# Attendance writes invalidate the dates they touch; roster changes clear it.
+report_cache = ReportCache(maxsize=app.config['REPORT_CACHE_SIZE'], ttl=app.config['REPORT_CACHE_TTL'])
+
+def build_gallery_index(matrix):
+    """Search index for the enrollment gallery, or None to keep the exact scan (see GALLERY_INDEX)."""
+    if app.config['GALLERY_INDEX'] != 'ivf' or len(matrix) < app.config['IVF_MIN_GALLERY_SIZE']:
+        return None
+    return IVFIndex.build(matrix, nlist=app.config['IVF_NLIST'] or None, nprobe=app.config['IVF_NPROBE'])
+
+# With GALLERY_STORE_DIR set, the gallery is materialized once into memory-mapped
+# files shared by every worker process on this host (see models/gallery_store.py).
+if app.config['GALLERY_EXACT_RERANK'] and not app.config['GALLERY_STORE_DIR']:
+    # A per-process float32 copy would cost more memory than plain float32 storage.
+    raise RuntimeError("GALLERY_EXACT_RERANK needs GALLERY_STORE_DIR: the exact rows are read from the shared store.")
+gallery_store = GalleryStore(app.config['GALLERY_STORE_DIR'], DatabaseHelper.load_gallery_rows, dim=EMBEDDING_DIM,
+                             storage=app.config['GALLERY_STORAGE'], rerank=app.config['GALLERY_EXACT_RERANK'],
+                             check_interval=app.config['GALLERY_STORE_CHECK_INTERVAL'],
+                             index_factory=build_gallery_index) \
+    if app.config['GALLERY_STORE_DIR'] else None
+
+def load_shared_gallery(scope=None):
+    return gallery_store.gallery(scope, shortlist=app.config['GALLERY_SHORTLIST'])
+
+# Enrollment galleries (institution-wide and per branch/class) shared by all
+# recognition requests in this process. Every route that writes student_faces must update it.
+# Without the shared store, the gallery_version row tells other processes to reload.
+gallery_cache = GalleryCache(load_shared_gallery if gallery_store else DatabaseHelper.load_gallery, store=gallery_store,
+                             counter=None if gallery_store else GalleryVersion,
+                             check_interval=app.config['GALLERY_VERSION_CHECK_INTERVAL'])
 
 # ================= Attendance Manager =================
 # class AttendanceManager:
@@ -68,53 +241,284 @@ class DatabaseHelper:
 #         conn.close()
 
 class AttendanceManager:
+    # Rows per multi-row INSERT; keeps each statement well under max_allowed_packet.
+    MARK_BATCH_SIZE = 1000
+    # Date and rollup (branch, class) key of one attendance row, for refreshing its summary row.
+    RECORD_GROUP_QUERY = ("SELECT a.attendance_date, COALESCE(s.branch, '') AS branch, COALESCE(s.class, '') AS class "
+                          "FROM attendance a JOIN students s ON s.student_id = a.student_id WHERE a.id=%s")
+
     @staticmethod
-    def update_attendance(student_id, new_status):
-        today_str = date.today().strftime('%Y-%m-%d')
-        conn = DatabaseHelper.get_connection()
-        cursor = conn.cursor(dictionary=True)
-        # Execute the SELECT query.
-        cursor.execute(
-            "SELECT * FROM attendance WHERE student_id=%s AND DATE(timestamp)=%s", 
-            (student_id, today_str)
-        )
-        # Fetch one row (or all rows if needed) to ensure the result is fully read.
-        record = cursor.fetchone()
-        # Clear any unread results
-        while cursor.nextset():
-            pass
+    def mark_session(present_ids, all_ids, session_date=None, taken_at=None):
+        """
+        Record one attendance session: every student in `all_ids` is marked
+        present if in `present_ids`, absent otherwise. Uses the unique
+        (student_id, attendance_date) key to upsert all rows in one transaction.
+        An existing 'absent' can be upgraded to 'present', never the reverse.
+        `taken_at` is when the session was captured; rows get its date and time.
+        """
+        if taken_at is not None:
+            session_date, timestamp = taken_at.date(), taken_at
+        else:
+            session_date = session_date or date.today()
+            timestamp = datetime.combine(session_date, datetime.now().time())
+        present_ids = set(present_ids)
+        rows = [(student_id, timestamp, 'present' if student_id in present_ids else 'absent')
+                for student_id in all_ids]
+        if not rows:
+            return
 
-        if record:
-            if record['status'] == 'absent' and new_status == 'present':
-                cursor.execute(
-                    "UPDATE attendance SET status=%s WHERE id=%s", 
-                    ('present', record['id'])
-                )
+        def upsert():
+            conn = DatabaseHelper.get_connection()
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                for start in range(0, len(rows), AttendanceManager.MARK_BATCH_SIZE):
+                    cursor.executemany(
+                        "INSERT INTO attendance (student_id, timestamp, status) VALUES (%s, %s, %s) "
+                        "ON DUPLICATE KEY UPDATE status=IF(status='absent' AND VALUES(status)='present', 'present', status)",
+                        rows[start:start + AttendanceManager.MARK_BATCH_SIZE]
+                    )
                 conn.commit()
-        else:
-            cursor.execute(
-                "INSERT INTO attendance (student_id, status) VALUES (%s, %s)", 
-                (student_id, new_status)
-            )
-            conn.commit()
-        cursor.close()
-        conn.close()
+            except mysql.connector.Error:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                conn.close()
+
+        DatabaseHelper.with_retry(upsert)
+        # The rollup is refreshed after the commit, for this roster's classes only, so the
+        # upsert never holds locks on other classes' attendance or on the summary rows.
+        AttendanceManager.refresh_daily_summary([session_date], AttendanceManager.student_groups(all_ids))
+
+    @staticmethod
+    def get_roster(scope=None):
+        """Student ids in a (branch, class) scope, or every student when scope is None."""
+        conditions, params = DatabaseHelper.scope_conditions(scope)
+        query = "SELECT s.student_id FROM students s"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            roster = {row[0] for row in cursor.fetchall()}
+            cursor.close()
+        return roster
+
+    @staticmethod
+    def get_partitions():
+        """Distinct (branch, class) pairs that have students, for the session scope pickers."""
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT branch, class FROM students "
+                           "WHERE branch IS NOT NULL AND class IS NOT NULL ORDER BY branch, class")
+            partitions = cursor.fetchall()
+            cursor.close()
+        return partitions
+
+    @staticmethod
+    def student_groups(student_ids):
+        """Distinct rollup (branch, class) keys of the given students ('' for NULL)."""
+        student_ids = list(student_ids)
+        groups = set()
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(student_ids), AttendanceManager.MARK_BATCH_SIZE):
+                chunk = student_ids[start:start + AttendanceManager.MARK_BATCH_SIZE]
+                cursor.execute("SELECT DISTINCT COALESCE(branch, ''), COALESCE(class, '') FROM students "
+                               f"WHERE student_id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+                groups.update(tuple(row) for row in cursor.fetchall())
+            cursor.close()
+        return groups
+
+    @staticmethod
+    def refresh_daily_summary(dates, groups=None):
+        """
+        Recompute the attendance_daily_summary rows for the given dates from
+        the attendance table, limited to the (branch, class) `groups` when
+        given (None = every class). Call it after the attendance write has
+        committed: it runs in its own short transaction, retried on deadlock,
+        and then invalidates report_cache for the dates.
+        """
+        dates = sorted({d for d in dates if d})
+        if groups is not None:
+            groups = sorted(set(groups))
+        if not dates or groups == []:
+            return
+        date_sql = ", ".join(["%s"] * len(dates))
+        group_params = [value for group in groups for value in group] if groups else []
+        group_sql = ", ".join(["(%s, %s)"] * len(groups)) if groups else ""
+
+        def refresh():
+            conn = DatabaseHelper.get_connection()
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                if groups is None:
+                    cursor.execute(f"DELETE FROM attendance_daily_summary WHERE attendance_date IN ({date_sql})", dates)
+                    # Whole days: read through idx_attendance_date_student.
+                    source = f"""
+                        FROM attendance a JOIN students s ON s.student_id = a.student_id
+                        WHERE a.attendance_date IN ({date_sql})"""
+                    params = dates
+                else:
+                    cursor.execute(f"DELETE FROM attendance_daily_summary WHERE attendance_date IN ({date_sql}) "
+                                   f"AND (branch, class) IN ({group_sql})", dates + group_params)
+                    # Drive from the classes' students so only their attendance rows are read (and locked).
+                    source = f"""
+                        FROM students s STRAIGHT_JOIN attendance a
+                          ON a.student_id = s.student_id AND a.attendance_date IN ({date_sql})
+                        WHERE (COALESCE(s.branch, ''), COALESCE(s.class, '')) IN ({group_sql})"""
+                    params = dates + group_params
+                cursor.execute(f"""
+                    INSERT INTO attendance_daily_summary (attendance_date, branch, class, present, absent)
+                    SELECT a.attendance_date, COALESCE(s.branch, ''), COALESCE(s.class, ''),
+                           SUM(a.status = 'present'), SUM(a.status <> 'present')
+                    {source}
+                    GROUP BY a.attendance_date, COALESCE(s.branch, ''), COALESCE(s.class, '')
+                """, params)
+                conn.commit()
+            except mysql.connector.Error:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                conn.close()
+
+        DatabaseHelper.with_retry(refresh)
+        report_cache.invalidate_dates(dates)
+
+    @staticmethod
+    def student_dates(student_id):
+        """Dates on which the student has attendance rows (to refresh the rollup after student changes)."""
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT attendance_date FROM attendance WHERE student_id=%s", (student_id,))
+            dates = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        return dates
+
+    @staticmethod
+    def get_summary(start_date, end_date):
+        """Present/absent totals for a date range, read from the daily rollup."""
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT branch, class, CAST(SUM(present) AS SIGNED) AS present, CAST(SUM(absent) AS SIGNED) AS absent
+                FROM attendance_daily_summary
+                WHERE attendance_date BETWEEN %s AND %s
+                GROUP BY branch, class
+                ORDER BY branch, class
+            """, (start_date, end_date))
+            by_class = cursor.fetchall()
+            cursor.close()
+        present = sum(row['present'] for row in by_class)
+        absent = sum(row['absent'] for row in by_class)
+        return {'total': present + absent, 'present': present, 'absent': absent, 'by_class': by_class}
+
+    @staticmethod
+    def group_by_day(records):
+        """
+        Group attendance records by day (dd-mm-YYYY) in one pass, keeping one
+        record per student per day and preferring 'present' over 'absent'.
+        Record order within a day is preserved.
+        """
+        grouped = {}
+        positions = {}
+        for rec in records:
+            rec_date = rec['timestamp'].strftime("%d-%m-%Y") if rec['timestamp'] else "No Date"
+            day = grouped.setdefault(rec_date, [])
+            key = (rec_date, rec['student_id'])
+            pos = positions.get(key)
+            if pos is None:
+                positions[key] = len(day)
+                day.append(rec)
+            elif day[pos]['status'] != 'present' and rec['status'] == 'present':
+                day[pos] = rec
+        return grouped
+
+    @staticmethod
+    def iter_export_rows(start_date, end_date, start_time=None, end_time=None, chunk_size=None):
+        """
+        Yield export rows (roll_number, name, branch, status, timestamp) for
+        every student and day in the range. Rows are read through an
+        unbuffered cursor `chunk_size` at a time, so memory stays flat however
+        large the range is. The connection is held until the generator finishes.
+        """
+        chunk_size = chunk_size or app.config['EXPORT_CHUNK_SIZE']
+        query = """
+            SELECT s.roll_number, s.name, s.branch,
+                   IF(MAX(a.status = 'present'), 'present', 'absent') as status,
+                   MIN(a.timestamp) as timestamp
+            FROM students s
+            LEFT JOIN attendance a ON s.student_id = a.student_id
+              AND a.attendance_date BETWEEN %s AND %s
+        """
+        params = [start_date, end_date]
+        if start_time and end_time:
+            query += " AND a.attendance_time BETWEEN %s AND %s"
+            params.extend([start_time, end_time])
+        # One row per student per day, 'present' winning over 'absent' (same rule as group_by_day).
+        query += " GROUP BY s.student_id, s.roll_number, s.name, s.branch, a.attendance_date"
+        query += " ORDER BY a.attendance_date ASC, CAST(s.roll_number AS UNSIGNED) ASC"
+        conn = DatabaseHelper.get_connection()
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute(query, params)
+            default_timestamp = datetime.strptime(start_date, "%Y-%m-%d")
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                for roll_number, name, branch, status, timestamp in chunk:
+                    timestamp = (timestamp or default_timestamp).strftime("%d-%m-%Y %I:%M %p")
+                    yield roll_number, name, branch, status, timestamp
+        finally:
+            # Stopped early (e.g. the client went away): drain the stream before closing.
+            if conn.unread_result:
+                conn.consume_results()
+            cursor.close()
+            conn.close()
+
+    @staticmethod
+    def update_attendance(student_id, new_status):
+        present = [student_id] if new_status == 'present' else []
+        AttendanceManager.mark_session(present, [student_id])
+
+    @staticmethod
+    def _report_key(kind, start_date, end_date, start_time, end_time):
+        def norm_time(t):
+            return (t + ':00' if len(t) == 5 else t) if t else None
+        if not (start_time and end_time):
+            start_time = end_time = None
+        return (kind, start_date, end_date, norm_time(start_time), norm_time(end_time))
 
     @staticmethod
     def get_records(start_date, end_date, start_time=None, end_time=None):
+        """Attendance of every student over the range (LEFT JOIN), served from report_cache when possible."""
+        key = AttendanceManager._report_key('records', start_date, end_date, start_time, end_time)
+        records = report_cache.get(key)
+        if records is None:
+            generation = report_cache.generation()
+            records = AttendanceManager._query_records(start_date, end_date, start_time, end_time)
+            report_cache.put(key, start_date, end_date, records, generation=generation)
+        return records
+
+    @staticmethod
+    def _query_records(start_date, end_date, start_time=None, end_time=None):
         conn = DatabaseHelper.get_connection()
         cursor = conn.cursor(dictionary=True)
         query = """
             SELECT s.student_id, s.roll_number, s.name, s.branch, a.status, a.timestamp
             FROM students s
             LEFT JOIN attendance a ON s.student_id = a.student_id
-              AND DATE(a.timestamp) BETWEEN %s AND %s
+              AND a.attendance_date BETWEEN %s AND %s
         """
         params = [start_date, end_date]
         if start_time and end_time:
-            query += " AND TIME(a.timestamp) BETWEEN %s AND %s"
+            query += " AND a.attendance_time BETWEEN %s AND %s"
             params.extend([start_time, end_time])
-        query += " ORDER BY DATE(a.timestamp) ASC, CAST(s.roll_number AS UNSIGNED) ASC"
+        query += " ORDER BY a.attendance_date ASC, CAST(s.roll_number AS UNSIGNED) ASC"
         cursor.execute(query, params)
         records = cursor.fetchall()
         for rec in records:
@@ -124,6 +528,260 @@ class AttendanceManager:
         conn.close()
         return records
 
+    @staticmethod
+    def get_marked_records(start_date, end_date, start_time=None, end_time=None):
+        """Recorded attendance rows in the range (admin view), served from report_cache when possible."""
+        key = AttendanceManager._report_key('marked', start_date, end_date, start_time, end_time)
+        records = report_cache.get(key)
+        if records is None:
+            generation = report_cache.generation()
+            query = """
+                SELECT s.student_id, s.roll_number, s.name, s.branch, a.status, a.timestamp
+                FROM attendance a JOIN students s ON a.student_id = s.student_id
+                WHERE a.attendance_date >= %s AND a.attendance_date <= %s
+            """
+            params = [start_date, end_date]
+            if start_time and end_time:
+                query += " AND a.attendance_time BETWEEN %s AND %s"
+                params.extend([start_time, end_time])
+            query += " ORDER BY a.attendance_date ASC, CAST(s.roll_number AS UNSIGNED) ASC" #casted roll number into string to number
+            with DatabaseHelper.get_connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute(query, params)
+                records = cursor.fetchall()
+                cursor.close()
+            report_cache.put(key, start_date, end_date, records, generation=generation)
+        return records
+
+# ================= Attendance Job Manager =================
+# Recognition runs outside the HTTP request: routes persist the photos and a
+# job row, and these threads work through the pipeline while the browser polls.
+job_executor = concurrent.futures.ThreadPoolExecutor(max_workers=app.config['ATTENDANCE_JOB_THREADS'])
+
+class AttendanceJobManager:
+    # Detection confidence and match threshold for each capture source.
+    SOURCES = {
+        'live': (0.85, 0.7),
+        'upload': (0.90, 0.77), #matching score .62
+    }
+    # Jobs this process is running; their updated_at is refreshed by heartbeat().
+    _running = set()
+    _running_lock = threading.Lock()
+
+    @staticmethod
+    def job_dir(job_id):
+        return os.path.join(app.config['ATTENDANCE_JOB_DIR'], job_id)
+
+    @staticmethod
+    def parse_scope(value):
+        """Turn the 'branch::class' value of the session picker into a scope (None = all students)."""
+        if not value or '::' not in value:
+            return None
+        branch, _class = value.split('::', 1)
+        return (branch, _class)
+
+    @staticmethod
+    def create(username, source, photos, scope=None):
+        """Store the raw photo bytes and a queued job row, then schedule the job."""
+        job_id = uuid.uuid4().hex
+        job_dir = AttendanceJobManager.job_dir(job_id)
+        os.makedirs(job_dir, mode=0o700)
+        for idx, data in enumerate(photos):
+            with open(os.path.join(job_dir, f"{idx:04d}"), 'wb') as f:
+                f.write(data)
+        conn = DatabaseHelper.get_connection()
+        cursor = conn.cursor()
+        branch, _class = scope if scope is not None else (None, None)
+        cursor.execute("INSERT INTO attendance_jobs (job_id, username, source, branch, class, total_photos) "
+                       "VALUES (%s, %s, %s, %s, %s, %s)",
+                       (job_id, username, source, branch, _class, len(photos)))
+        conn.commit()
+        cursor.close()
+        conn.close()
+        job_executor.submit(AttendanceJobManager.run, job_id)
+        return job_id
+
+    @staticmethod
+    def get(job_id):
+        conn = DatabaseHelper.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM attendance_jobs WHERE job_id=%s", (job_id,))
+        job = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        return job
+
+    @staticmethod
+    def update(job_id, **fields):
+        conn = DatabaseHelper.get_connection()
+        cursor = conn.cursor()
+        assignments = ", ".join(f"{name}=%s" for name in fields)
+        cursor.execute(f"UPDATE attendance_jobs SET {assignments} WHERE job_id=%s", (*fields.values(), job_id))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    @staticmethod
+    def resume_pending(orphaned_only=False):
+        """
+        Re-schedule jobs whose process went away: running jobs with no
+        heartbeat for ATTENDANCE_JOB_STALE_SECONDS are re-queued, then queued
+        jobs are submitted here (only long-waiting ones with `orphaned_only`;
+        a job submitted twice is still claimed by one thread only).
+        """
+        stale = app.config['ATTENDANCE_JOB_STALE_SECONDS']
+        conn = DatabaseHelper.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("UPDATE attendance_jobs SET status='queued' WHERE status='running' "
+                       "AND updated_at < NOW() - INTERVAL %s SECOND", (stale,))
+        conn.commit()
+        if orphaned_only:
+            cursor.execute("SELECT job_id FROM attendance_jobs WHERE status='queued' "
+                           "AND updated_at < NOW() - INTERVAL %s SECOND ORDER BY created_at", (stale,))
+        else:
+            cursor.execute("SELECT job_id FROM attendance_jobs WHERE status='queued' ORDER BY created_at")
+        job_ids = [row['job_id'] for row in cursor.fetchall()]
+        cursor.close()
+        conn.close()
+        for job_id in job_ids:
+            job_executor.submit(AttendanceJobManager.run, job_id)
+
+    @staticmethod
+    def heartbeat():
+        """Mark this process's running jobs as alive so no other process re-queues them."""
+        with AttendanceJobManager._running_lock:
+            job_ids = list(AttendanceJobManager._running)
+        if not job_ids:
+            return
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE attendance_jobs SET updated_at=NOW() WHERE status='running' "
+                           f"AND job_id IN ({', '.join(['%s'] * len(job_ids))})", job_ids)
+            cursor.close()
+
+    @staticmethod
+    def watch(interval):
+        """Heartbeat loop of a serving process; also picks up jobs orphaned by processes that died."""
+        while True:
+            time.sleep(interval)
+            try:
+                AttendanceJobManager.heartbeat()
+                AttendanceJobManager.resume_pending(orphaned_only=True)
+            except Exception as e:
+                print(f"Attendance job watcher: {e}")
+
+    @staticmethod
+    def run(job_id):
+        # Claim the job atomically so only one process ever works on it.
+        conn = DatabaseHelper.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE attendance_jobs SET status='running', processed_photos=0, attempts=attempts+1 "
+                       "WHERE job_id=%s AND status='queued'", (job_id,))
+        conn.commit()
+        claimed = cursor.rowcount == 1
+        cursor.close()
+        conn.close()
+        if not claimed:
+            return
+        with AttendanceJobManager._running_lock:
+            AttendanceJobManager._running.add(job_id)
+        job = None
+        try:
+            job = AttendanceJobManager.get(job_id)
+            recognized, filenames = AttendanceJobManager.process(job)
+            AttendanceJobManager.update(job_id, status='done', recognized_count=len(recognized),
+                                        result_images=json.dumps(filenames))
+        except Exception as e:
+            print(f"Attendance job {job_id} failed: {e}")
+            attempts = job['attempts'] if job else app.config['ATTENDANCE_JOB_MAX_ATTEMPTS']
+            if AttendanceJobManager.is_transient(e) and attempts < app.config['ATTENDANCE_JOB_MAX_ATTEMPTS']:
+                # Keep the photos and run the job again after a back-off.
+                AttendanceJobManager.update(job_id, status='queued', error=str(e)[:255])
+                retry = threading.Timer(app.config['ATTENDANCE_JOB_RETRY_DELAY'] * attempts,
+                                        job_executor.submit, (AttendanceJobManager.run, job_id))
+                retry.daemon = True
+                retry.start()
+                return
+            AttendanceJobManager.update(job_id, status='failed', error=str(e)[:255])
+        finally:
+            with AttendanceJobManager._running_lock:
+                AttendanceJobManager._running.discard(job_id)
+        # Done, or failed for good: the photos are no longer needed.
+        shutil.rmtree(AttendanceJobManager.job_dir(job_id), ignore_errors=True)
+
+    @staticmethod
+    def is_transient(error):
+        """Failures worth retrying: a crashed inference worker, or a database hiccup."""
+        if isinstance(error, BrokenProcessPool):
+            return True
+        if isinstance(error, mysql.connector.Error):
+            return (error.errno in DatabaseHelper.TRANSIENT_ERRNOS or isinstance(error, PoolTimeout)
+                    or isinstance(error, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)))
+        return False
+
+    @staticmethod
+    def prepare_image(source, data):
+        """Decode a stored photo; returns (image to detect on, image to embed and annotate)."""
+        if source == 'live':
+            image = np.array(Image.open(io.BytesIO(data)))
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            # image = RegistrationManager.choose_filter_for_registration(image) #filter - live
+            # Faces are detected on the raw frame but embedded from the CLAHE-filtered one.
+            return image, apply_clahe_filter(image) #added
+        img = np.array(Image.open(io.BytesIO(data)).convert('RGB'))
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        # img = apply_clahe_filter(img)
+        img = apply_bluish_filter(img)
+        # img = RegistrationManager.choose_filter_for_registration(img) # filter - manual
+        return img, img
+
+    @staticmethod
+    def submit_photo(image, embed_image, min_confidence):
+        # Blocks until a queue slot frees up instead of failing.
+        return inference_pool.detect_and_embed(image, min_confidence, app.config['EMBEDDING_BATCH_SIZE'],
+                                               embed_image=embed_image,
+                                               max_side=app.config['DETECTION_MAX_SIDE'] or None,
+                                               min_face_size=app.config['DETECTION_MIN_FACE_SIZE'] or None,
+                                               tile_size=app.config['DETECTION_TILE_SIZE'] or None,
+                                               tile_overlap=app.config['DETECTION_TILE_OVERLAP'],
+                                               tile_workers=app.config['DETECTION_TILE_WORKERS'])
+
+    @staticmethod
+    def process(job):
+        job_id, source = job['job_id'], job['source']
+        min_confidence, threshold = AttendanceJobManager.SOURCES[source]
+        # A scoped session only searches, and only marks, that class's students.
+        scope = (job['branch'], job['class']) if job['branch'] is not None else None
+        gallery = gallery_cache.get(scope)
+        job_dir = AttendanceJobManager.job_dir(job_id)
+        pending = []
+        for name in sorted(os.listdir(job_dir)):
+            with open(os.path.join(job_dir, name), 'rb') as f:
+                image, embed_image = AttendanceJobManager.prepare_image(source, f.read())
+            pending.append((embed_image, AttendanceJobManager.submit_photo(image, embed_image, min_confidence)))
+        recognized = set()
+        filenames = []
+        for idx, (img, future) in enumerate(pending):
+            faces, embeddings = future.result()
+            if len(faces) or source != 'live':
+                matches = gallery.match(embeddings, threshold=threshold)
+                for box, (best, best_score) in zip(faces.boxes, matches):
+                    x, y, w, h = (int(v) for v in box)
+                    if best is not None:
+                        recognized.add(best)
+                        cv2.rectangle(img, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                        cv2.putText(img, best, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    else:
+                        cv2.rectangle(img, (x, y), (x+w, y+h), (0, 0, 255), 2)
+                        cv2.putText(img, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+                fname = f"attendance_{job_id}_{idx}.jpg"
+                cv2.imwrite(os.path.join(app.config['UPLOAD_FOLDER'], fname), img)
+                filenames.append(fname)
+            AttendanceJobManager.update(job_id, processed_photos=idx + 1)
+        # Recorded for when the photos were submitted, however long the job queued or was resumed.
+        AttendanceManager.mark_session(recognized, AttendanceManager.get_roster(scope), taken_at=job['created_at'])
+        return recognized, filenames
+
 # ================= Registration Manager =================
 class RegistrationManager:
     @staticmethod
@@ -146,8 +804,7 @@ class RegistrationManager:
     @staticmethod
     def validate_single_face(image, min_confidence=0.95, iou_threshold=0.8):
         processed_image = RegistrationManager.choose_filter_for_registration(image)
-        faces = detect_faces(processed_image, min_confidence=min_confidence)
-        faces = nms_faces(faces, iou_threshold=iou_threshold)
+        faces = nms(detect(processed_image, min_confidence=min_confidence), iou_threshold=iou_threshold)
         print(len(faces))
         return (len(faces) == 1), processed_image
 
@@ -156,6 +813,11 @@ class RegistrationManager:
 def root():
     return redirect(url_for('welcome'))
 
+@app.route('/healthz')
+def healthz():
+    ready = inference_pool.ready or not (app.config['ENABLE_RECOGNITION'] and app.config['WARMUP_ON_STARTUP'])
+    return {'status': 'ready' if ready else 'warming_up'}, (200 if ready else 503)
+
 @app.route('/welcome')
 def welcome():
     return render_template('welcome.html')
@@ -196,19 +858,29 @@ def admin_index():
         return redirect(url_for('login'))
     return render_template('admin_index.html')
 
+@app.route('/admin/stats')
+def admin_stats():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return {'error': 'Access denied.'}, 403
+    return {'db_pool': db_pool.stats(), 'report_cache': report_cache.stats()}
+
 # --- Teacher Management ---
 @app.route('/admin/teachers')
 def list_teachers():
     if 'user' not in session or session['user']['role'] != 'admin':
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
+    q = request.args.get('q', '').strip()
+    conditions, params = [], []
+    if q:
+        conditions.append("(name LIKE %s OR username LIKE %s)")
+        params.extend([q + '%', q + '%'])
     conn = DatabaseHelper.get_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM teachers")
-    teachers = cursor.fetchall()
+    teachers, pagination = PaginationHelper.fetch(cursor, "teachers", "teacher_id", conditions, params)
     cursor.close()
     conn.close()
-    return render_template('list_teachers.html', teachers=teachers)
+    return render_template('list_teachers.html', teachers=teachers, pagination=pagination)
 
 @app.route('/admin/teachers/add', methods=['GET','POST'])
 def add_teacher():
@@ -227,23 +899,22 @@ def add_teacher():
             path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             Image.open(photo_file.stream).save(path)
             photo_url = url_for('static', filename='uploads/' + filename)
-        conn = DatabaseHelper.get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO teachers (name, email, username, photo) VALUES (%s, %s, %s, %s)",
-                           (name, email, username, photo_url))
-            conn.commit()
-        except mysql.connector.errors.IntegrityError:
-            flash("Teacher with that username may already exist.", "danger")
-            return redirect(url_for('add_teacher'))
-        try:
-            cursor.execute("INSERT INTO users (username, password, role) VALUES (%s, %s, 'teacher')", (username, password))
-            conn.commit()
-        except mysql.connector.errors.IntegrityError:
-            flash("Duplicate username in users table.", "danger")
-            return redirect(url_for('add_teacher'))
-        cursor.close()
-        conn.close()
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("INSERT INTO teachers (name, email, username, photo) VALUES (%s, %s, %s, %s)",
+                               (name, email, username, photo_url))
+                conn.commit()
+            except mysql.connector.errors.IntegrityError:
+                flash("Teacher with that username may already exist.", "danger")
+                return redirect(url_for('add_teacher'))
+            try:
+                cursor.execute("INSERT INTO users (username, password, role) VALUES (%s, %s, 'teacher')", (username, password))
+                conn.commit()
+            except mysql.connector.errors.IntegrityError:
+                flash("Duplicate username in users table.", "danger")
+                return redirect(url_for('add_teacher'))
+            cursor.close()
         flash("Teacher added successfully.", "success")
         return redirect(url_for('list_teachers'))
     return render_template('add_teacher.html')
@@ -301,13 +972,25 @@ def list_students():
     if 'user' not in session or session['user']['role'] != 'admin':
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
+    q = request.args.get('q', '').strip()
+    branch = request.args.get('branch', '').strip()
+    _class = request.args.get('class', '').strip()
+    conditions, params = [], []
+    if q:
+        conditions.append("(student_id LIKE %s OR name LIKE %s)")
+        params.extend([q + '%', q + '%'])
+    if branch:
+        conditions.append("branch = %s")
+        params.append(branch)
+    if _class:
+        conditions.append("class = %s")
+        params.append(_class)
     conn = DatabaseHelper.get_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM students")
-    students = cursor.fetchall()
+    students, pagination = PaginationHelper.fetch(cursor, "students", "student_id", conditions, params)
     cursor.close()
     conn.close()
-    return render_template('list_students.html', students=students)
+    return render_template('list_students.html', students=students, pagination=pagination)
 
 @app.route('/admin/students/add', methods=['GET','POST'])
 def add_student():
@@ -324,36 +1007,43 @@ def add_student():
         if not all(files) or any(f.filename == "" for f in files):
             flash("Please upload exactly three photos.", "warning")
             return redirect(url_for('add_student'))
-        conn = DatabaseHelper.get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO students (student_id, name, branch, class, roll_number) VALUES (%s, %s, %s, %s, %s)",
-                           (student_id, name, branch, _class, roll_number))
-            conn.commit()
-        except mysql.connector.errors.IntegrityError:
-            flash("Student ID already exists.", "danger")
+        if not app.config['ENABLE_RECOGNITION']:
+            flash("Face recognition is disabled on this server.", "danger")
             return redirect(url_for('add_student'))
+        face_imgs, image_urls = [], []
         for file in files:
             image = np.array(Image.open(file.stream).convert('RGB'))
             valid, proc_image = RegistrationManager.validate_single_face(image, min_confidence=0.95, iou_threshold=0.8)
             if not valid:
                 flash("Each student registration photo must contain exactly one clear face.", "danger")
                 return redirect(url_for('add_student'))
-            faces = detect_faces(proc_image, min_confidence=0.90)
-            faces = nms_faces(faces, iou_threshold=0.7)
-            box = faces[0]['box']
+            box = nms(detect(proc_image, min_confidence=0.90), iou_threshold=0.7).boxes[0]
             # proc_image = RegistrationManager.choose_filter_for_registration(proc_image) # filter - adding student ++ /blue
-            face_img = extract_face(proc_image, box)
-            embedding = get_embedding(face_img)
-            emb_str = ",".join(map(str, embedding.tolist()))
+            face_imgs.append(extract_face(proc_image, box))
             filename = f"{student_id}_{datetime.now().timestamp()}_{secure_filename(file.filename)}"
             path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             Image.fromarray(proc_image).save(path)
-            cursor.execute("INSERT INTO student_faces (student_id, embedding, image_path) VALUES (%s, %s, %s)",
-                           (student_id, emb_str, url_for('static', filename='uploads/' + filename)))
-            conn.commit()
-        cursor.close()
-        conn.close()
+            image_urls.append(url_for('static', filename='uploads/' + filename))
+        embeddings = get_embeddings(face_imgs, batch_size=app.config['EMBEDDING_BATCH_SIZE'])
+        # The student and their faces are written together only after every photo passed validation.
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                cursor.execute("INSERT INTO students (student_id, name, branch, class, roll_number) VALUES (%s, %s, %s, %s, %s)",
+                               (student_id, name, branch, _class, roll_number))
+                for embedding, image_url in zip(embeddings, image_urls):
+                    cursor.execute("INSERT INTO student_faces (student_id, embedding, embedding_dim, model_version, image_path) VALUES (%s, %s, %s, %s, %s)",
+                                   (student_id, encode_embedding(embedding), EMBEDDING_DIM, EMBEDDING_MODEL_VERSION, image_url))
+                conn.commit()
+            except mysql.connector.errors.IntegrityError:
+                conn.rollback()
+                flash("Student ID already exists.", "danger")
+                return redirect(url_for('add_student'))
+            finally:
+                cursor.close()
+        gallery_cache.replace_student(student_id, embeddings, scope=(branch, _class))
+        report_cache.clear()
         flash("Student added successfully.", "success")
         return redirect(url_for('list_students'))
     return render_template('add_student.html')
@@ -363,48 +1053,68 @@ def edit_student(student_id):
     if 'user' not in session or session['user']['role'] != 'admin':
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
-    conn = DatabaseHelper.get_connection()
-    cursor = conn.cursor(dictionary=True)
     if request.method == 'POST':
         name = request.form.get('name')
         branch = request.form.get('branch')
         _class = request.form.get('class')
         roll_number = request.form.get('roll_number')
-        cursor.execute("UPDATE students SET name=%s, branch=%s, class=%s, roll_number=%s WHERE student_id=%s",
-                       (name, branch, _class, roll_number, student_id))
-        conn.commit()
+        old_groups = AttendanceManager.student_groups([student_id])
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE students SET name=%s, branch=%s, class=%s, roll_number=%s WHERE student_id=%s",
+                           (name, branch, _class, roll_number, student_id))
+            conn.commit()
+            cursor.close()
+        report_cache.clear()
+        # Branch/class may have changed, which moves the student's days between rollup rows.
+        AttendanceManager.refresh_daily_summary(AttendanceManager.student_dates(student_id),
+                                                old_groups | {(branch or '', _class or '')})
+        # The student may have moved to another partition gallery. The gallery is updated
+        # exactly once per request below: in store mode every update is a full rebuild.
         files = [request.files.get('face_photo1'), request.files.get('face_photo2'), request.files.get('face_photo3')]
         if all(files) and not any(f.filename == "" for f in files):
-            cursor.execute("DELETE FROM student_faces WHERE student_id=%s", (student_id,))
-            conn.commit()
+            if not app.config['ENABLE_RECOGNITION']:
+                gallery_cache.invalidate_partitions()
+                flash("Face recognition is disabled on this server.", "danger")
+                return redirect(url_for('edit_student', student_id=student_id))
+            face_imgs, image_urls = [], []
             for file in files:
                 image = np.array(Image.open(file.stream).convert('RGB'))
                 valid, proc_image = RegistrationManager.validate_single_face(image, min_confidence=0.95, iou_threshold=0.85)
                 if not valid:
+                    gallery_cache.invalidate_partitions()
                     flash("Each student photo must contain exactly one clear face.", "danger")
                     return redirect(url_for('edit_student', student_id=student_id))
-                faces = detect_faces(proc_image, min_confidence=0.95)
-                faces = nms_faces(faces, iou_threshold=0.85)
-                box = faces[0]['box']
+                box = nms(detect(proc_image, min_confidence=0.95), iou_threshold=0.85).boxes[0]
                 # proc_image = RegistrationManager.choose_filter_for_registration(proc_image) # filter - updating student ++ /blue
-                face_img = extract_face(proc_image, box)
-                embedding = get_embedding(face_img)
-                emb_str = ",".join(map(str, embedding.tolist()))
+                face_imgs.append(extract_face(proc_image, box))
                 filename = f"{student_id}_{datetime.now().timestamp()}_{secure_filename(file.filename)}"
                 path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 Image.fromarray(proc_image).save(path)
-                cursor.execute("INSERT INTO student_faces (student_id, embedding, image_path) VALUES (%s, %s, %s)",
-                               (student_id, emb_str, url_for('static', filename='uploads/' + filename)))
+                image_urls.append(url_for('static', filename='uploads/' + filename))
+            # Old enrollment is only replaced once every new photo has been validated.
+            embeddings = get_embeddings(face_imgs, batch_size=app.config['EMBEDDING_BATCH_SIZE'])
+            with DatabaseHelper.get_connection() as conn:
+                cursor = conn.cursor()
+                conn.start_transaction()
+                cursor.execute("DELETE FROM student_faces WHERE student_id=%s", (student_id,))
+                for embedding, image_url in zip(embeddings, image_urls):
+                    cursor.execute("INSERT INTO student_faces (student_id, embedding, embedding_dim, model_version, image_path) VALUES (%s, %s, %s, %s, %s)",
+                                   (student_id, encode_embedding(embedding), EMBEDDING_DIM, EMBEDDING_MODEL_VERSION, image_url))
                 conn.commit()
-        cursor.close()
-        conn.close()
+                cursor.close()
+            # Also moves the student out of their old partition gallery.
+            gallery_cache.replace_student(student_id, embeddings, scope=(branch, _class))
+        else:
+            gallery_cache.invalidate_partitions()
         flash("Student updated successfully.", "success")
         return redirect(url_for('list_students'))
     else:
-        cursor.execute("SELECT * FROM students WHERE student_id=%s", (student_id,))
-        student = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with DatabaseHelper.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM students WHERE student_id=%s", (student_id,))
+            student = cursor.fetchone()
+            cursor.close()
         return render_template('edit_student.html', student=student)
 
 @app.route('/admin/students/delete/<student_id>')
@@ -412,16 +1122,22 @@ def delete_student(student_id):
     if 'user' not in session or session['user']['role'] != 'admin':
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
-    conn = DatabaseHelper.get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM students WHERE student_id=%s", (student_id,))
-        conn.commit()
-    except mysql.connector.errors.IntegrityError as e:
-        flash("Cannot delete student due to related attendance records.", "danger")
-        return redirect(url_for('list_students'))
-    cursor.close()
-    conn.close()
+    attendance_dates = AttendanceManager.student_dates(student_id)
+    groups = AttendanceManager.student_groups([student_id])
+    with DatabaseHelper.get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM students WHERE student_id=%s", (student_id,))
+            conn.commit()
+        except mysql.connector.errors.IntegrityError as e:
+            flash("Cannot delete student due to related attendance records.", "danger")
+            return redirect(url_for('list_students'))
+        finally:
+            cursor.close()
+    gallery_cache.remove_student(student_id)
+    report_cache.clear()
+    # The delete cascaded to the student's attendance rows.
+    AttendanceManager.refresh_daily_summary(attendance_dates, groups)
     flash("Student deleted successfully.", "success")
     return redirect(url_for('list_students'))
 
@@ -438,47 +1154,23 @@ def admin_attendance():
     current_time = datetime.now().strftime("%H:%M:%S")
     if start_time and not end_time:
         end_time = current_time
+    records = AttendanceManager.get_marked_records(start_date, end_date, start_time, end_time)
     conn = DatabaseHelper.get_connection()
     cursor = conn.cursor(dictionary=True)
-    query = """
-        SELECT s.student_id, s.roll_number, s.name, s.branch, a.status, a.timestamp
-        FROM attendance a JOIN students s ON a.student_id = s.student_id
-    """
-    conditions = []
-    params = []
-    if start_date:
-        conditions.append("DATE(a.timestamp) >= %s")
-        params.append(start_date)
-    if end_date:
-        conditions.append("DATE(a.timestamp) <= %s")
-        params.append(end_date)
-    if start_time and end_time:
-        conditions.append("TIME(a.timestamp) BETWEEN %s AND %s")
-        params.extend([start_time, end_time])
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    query += " ORDER BY DATE(a.timestamp) ASC, CAST(s.roll_number AS UNSIGNED) ASC" #casted roll number into string to number
-    cursor.execute(query, params)
-    records = cursor.fetchall()
     cursor.execute("SELECT COUNT(*) as total FROM students")
     total = cursor.fetchone()['total']
-    present = sum(1 for r in records if r['status'] == 'present')
+    if start_time and end_time:
+        # The daily rollup has no time-of-day breakdown.
+        present = sum(1 for r in records if r['status'] == 'present')
+        by_class = []
+    else:
+        rollup = AttendanceManager.get_summary(start_date, end_date)
+        present, by_class = rollup['present'], rollup['by_class']
     absent = total - present
     if absent < 0:
         absent = 0
-    summary = {'total': total, 'present': present, 'absent': absent}
-    grouped = {}
-    for rec in records:
-        rec_date = rec['timestamp'].strftime("%d-%m-%Y") if rec['timestamp'] else "No Date"
-        if rec_date not in grouped:
-            grouped[rec_date] = []
-        if not any(r['student_id'] == rec['student_id'] for r in grouped[rec_date]):
-            grouped[rec_date].append(rec)
-        else:
-            existing = next(r for r in grouped[rec_date] if r['student_id'] == rec['student_id'])
-            if existing['status'] != 'present' and rec['status'] == 'present':
-                grouped[rec_date].remove(existing)
-                grouped[rec_date].append(rec)
+    summary = {'total': total, 'present': present, 'absent': absent, 'by_class': by_class}
+    grouped = AttendanceManager.group_by_day(records)
     cursor.close()
     conn.close()
     return render_template('show_attendance.html', grouped_records=grouped, summary=summary)
@@ -492,10 +1184,15 @@ def edit_attendance(attendance_id):
     cursor = conn.cursor(dictionary=True)
     if request.method == 'POST':
         status = request.form.get('status')
+        conn.start_transaction()
         cursor.execute("UPDATE attendance SET status=%s WHERE id=%s", (status, attendance_id))
+        cursor.execute(AttendanceManager.RECORD_GROUP_QUERY, (attendance_id,))
+        record = cursor.fetchone()
         conn.commit()
         cursor.close()
         conn.close()
+        if record:
+            AttendanceManager.refresh_daily_summary([record['attendance_date']], [(record['branch'], record['class'])])
         flash("Attendance record updated.", "success")
         return redirect(url_for('admin_attendance'))
     else:
@@ -511,11 +1208,16 @@ def delete_attendance(attendance_id):
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
     conn = DatabaseHelper.get_connection()
-    cursor = conn.cursor()
+    cursor = conn.cursor(dictionary=True)
+    conn.start_transaction()
+    cursor.execute(AttendanceManager.RECORD_GROUP_QUERY + " FOR UPDATE", (attendance_id,))
+    record = cursor.fetchone()
     cursor.execute("DELETE FROM attendance WHERE id=%s", (attendance_id,))
     conn.commit()
     cursor.close()
     conn.close()
+    if record:
+        AttendanceManager.refresh_daily_summary([record['attendance_date']], [(record['branch'], record['class'])])
     flash("Attendance record deleted.", "success")
     return redirect(url_for('admin_attendance'))
 
@@ -530,16 +1232,38 @@ def manage_attendance():
         student_id = request.form.get('student_id')
         date_str = request.form.get('date')
         status = request.form.get('status')
-        cursor.execute("INSERT INTO attendance (student_id, timestamp, status) VALUES (%s, %s, %s)", (student_id, date_str, status))
+        # An explicit admin entry replaces whatever was recorded for that student and day.
+        conn.start_transaction()
+        cursor.execute("INSERT INTO attendance (student_id, timestamp, status) VALUES (%s, %s, %s) "
+                       "ON DUPLICATE KEY UPDATE status=VALUES(status)", (student_id, date_str, status))
+        cursor.execute("SELECT DATE(%s) AS d", (date_str,))
+        attendance_date = cursor.fetchone()['d']
         conn.commit()
+        AttendanceManager.refresh_daily_summary([attendance_date], AttendanceManager.student_groups([student_id]))
         flash("Attendance record added.", "success")
-    cursor.execute("SELECT * FROM attendance")
-    records = cursor.fetchall()
-    for r in records:
-        r['date'] = r['timestamp'].strftime('%Y-%m-%d')
+    student_filter = request.args.get('student_id', '').strip()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    status_filter = request.args.get('status', '').strip()
+    conditions, params = [], []
+    if student_filter:
+        conditions.append("student_id = %s")
+        params.append(student_filter)
+    if start_date:
+        conditions.append("attendance_date >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("attendance_date <= %s")
+        params.append(end_date)
+    if status_filter:
+        conditions.append("status = %s")
+        params.append(status_filter)
+    # Newest records first.
+    records, pagination = PaginationHelper.fetch(cursor, "attendance", "id", conditions, params, descending=True,
+                                                 columns="id, student_id, timestamp, status")
     cursor.close()
     conn.close()
-    return render_template('manage_attendance.html', records=records)
+    return render_template('manage_attendance.html', records=records, pagination=pagination)
 
 # ---------------- Admin Registration Requests ----------------
 @app.route('/admin/requests', endpoint='list_requests')
@@ -547,13 +1271,17 @@ def list_requests():
     if 'user' not in session or session['user']['role'] != 'admin':
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
+    status = request.args.get('status', '').strip()
+    conditions, params = [], []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
     conn = DatabaseHelper.get_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM student_requests")
-    requests_data = cursor.fetchall()
+    requests_data, pagination = PaginationHelper.fetch(cursor, "student_requests", "request_id", conditions, params)
     cursor.close()
     conn.close()
-    return render_template('list_requests.html', requests=requests_data)
+    return render_template('list_requests.html', requests=requests_data, pagination=pagination)
 
 @app.route('/admin/action', methods=['POST'])
 def admin_action():
@@ -576,6 +1304,11 @@ def admin_action():
         cursor.close()
         conn.close()
         return redirect(url_for('list_requests'))
+    if action == 'approved' and not app.config['ENABLE_RECOGNITION']:
+        flash("Face recognition is disabled on this server.", "danger")
+        cursor.close()
+        conn.close()
+        return redirect(url_for('list_requests'))
     if action == 'approved':
         photos = [req_data['photo1'], req_data['photo2'], req_data['photo3']]
         for photo_url in photos:
@@ -605,21 +1338,22 @@ def admin_action():
             cursor.close()
             conn.close()
             return redirect(url_for('list_requests'))
+        face_imgs = []
         for photo_url in photos:
             filename = secure_filename(photo_url.split('/')[-1])
             image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             image = np.array(Image.open(image_path))
             # image = apply_clahe_filter(image) -- add below enhance feature then blue
             image = RegistrationManager.choose_filter_for_registration(image) # filter - storing in db -admin add
-            faces = detect_faces(image, min_confidence=0.90)
-            faces = nms_faces(faces, iou_threshold=0.7)
-            box = faces[0]['box']
-            face_img = extract_face(image, box)
-            embedding = get_embedding(face_img)
-            emb_str = ",".join(map(str, embedding.tolist()))
-            cursor.execute("INSERT INTO student_faces (student_id, embedding, image_path) VALUES (%s, %s, %s)",
-                           (student_id, emb_str, photo_url))
-            conn.commit()
+            box = nms(detect(image, min_confidence=0.90), iou_threshold=0.7).boxes[0]
+            face_imgs.append(extract_face(image, box))
+        embeddings = get_embeddings(face_imgs, batch_size=app.config['EMBEDDING_BATCH_SIZE'])
+        for embedding, photo_url in zip(embeddings, photos):
+            cursor.execute("INSERT INTO student_faces (student_id, embedding, embedding_dim, model_version, image_path) VALUES (%s, %s, %s, %s, %s)",
+                           (student_id, encode_embedding(embedding), EMBEDDING_DIM, EMBEDDING_MODEL_VERSION, photo_url))
+        conn.commit()
+        gallery_cache.replace_student(student_id, embeddings, scope=(req_data['branch'], req_data['class']))
+        report_cache.clear()
     cursor.execute("UPDATE student_requests SET status=%s WHERE request_id=%s", (action, request_id))
     conn.commit()
     cursor.close()
@@ -633,80 +1367,29 @@ def teacher_index():
     if 'user' not in session or session['user']['role'] != 'teacher':
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
-    return render_template('teacher_index.html')
+    return render_template('teacher_index.html', partitions=AttendanceManager.get_partitions())
 
 @app.route('/teacher/attendance_live', methods=['POST'])
 def attendance_live():
     if 'user' not in session or session['user']['role'] != 'teacher':
         flash("Access denied.", "danger")
         return redirect(url_for('login'))
+    if not app.config['ENABLE_RECOGNITION']:
+        flash("Face recognition is disabled on this server.", "danger")
+        return redirect(url_for('teacher_index'))
     photo_data_json = request.form.get('photoData')
     if not photo_data_json:
         flash("No captured photos found.", "warning")
         return redirect(url_for('teacher_index'))
     try:
         data_urls = json.loads(photo_data_json)
+        photos = [base64.b64decode(data_url.split(',', 1)[1]) for data_url in data_urls]
     except Exception as e:
         flash("Error parsing captured photos.", "danger")
         return redirect(url_for('teacher_index'))
-    all_annotated = []
-    recognized = set()
-    for data_url in data_urls:
-        header, encoded = data_url.split(',', 1)
-        data = base64.b64decode(encoded)
-        image = np.array(Image.open(io.BytesIO(data)))
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        # image = RegistrationManager.choose_filter_for_registration(image) #filter - live
-        faces = detect_faces(image, min_confidence=0.85)
-        if not faces:
-            continue
-        conn = DatabaseHelper.get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT student_id, embedding FROM student_faces")
-        face_db = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        image=apply_clahe_filter(image) #added
-        for face in faces:
-            box = face['box']
-            x, y, w, h = box
-            face_img = extract_face(image, box)
-            emb = get_embedding(face_img)
-            best, best_score = None, -1
-            for rec in face_db:
-                stored = np.array(list(map(float, rec['embedding'].split(','))))
-                score = cosine_similarity(emb, stored)
-                if score > best_score:
-                    best_score = score
-                    best = rec['student_id']
-            if best_score > 0.7:
-                recognized.add(best)
-                cv2.rectangle(image, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                cv2.putText(image, best, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-            else:
-                cv2.rectangle(image, (x, y), (x+w, y+h), (0, 0, 255), 2)
-                cv2.putText(image, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-        all_annotated.append(image) #returning image for live
-    conn = DatabaseHelper.get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT student_id FROM students")
-    all_students = {row['student_id'] for row in cursor.fetchall()}
-    cursor.close()
-    conn.close()
-    for student in all_students:
-        if student in recognized:
-            AttendanceManager.update_attendance(student, 'present')
-        else:
-            AttendanceManager.update_attendance(student, 'absent')
-    filenames = []
-    for idx, img in enumerate(all_annotated):
-        fname = f"attendance_{datetime.now().timestamp()}_{idx}.jpg"
-        path = os.path.join(app.config['UPLOAD_FOLDER'], fname)
-        cv2.imwrite(path, img)
-        filenames.append(fname)
-    flash(f"Attendance processed from live capture. Recognized: {len(recognized)} students.", "success")
-    image_urls = [url_for('static', filename='uploads/' + f) for f in filenames]
-    return render_template('attendance_result.html', image_urls=image_urls)
+    job_id = AttendanceJobManager.create(session['user']['username'], 'live', photos,
+                                         scope=AttendanceJobManager.parse_scope(request.form.get('scope')))
+    return redirect(url_for('attendance_job', job_id=job_id))
 
 @app.route('/teacher/attendance', methods=['GET','POST'])
 def teacher_attendance():
@@ -718,66 +1401,44 @@ def teacher_attendance():
         if not photos or all(photo.filename == "" for photo in photos):
             flash("Please upload at least one photo.", "warning")
             return redirect(url_for('teacher_attendance'))
-        recognized = set()
-        annotated_imgs = []
-        def process_photo(file):
-            img = np.array(Image.open(file.stream).convert('RGB'))
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-            # img = apply_clahe_filter(img)
-            img = apply_bluish_filter(img)
-            # img = RegistrationManager.choose_filter_for_registration(img) # filter - manual
-            faces = detect_faces(img, min_confidence=0.90)
-            conn = DatabaseHelper.get_connection()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT student_id, embedding FROM student_faces")
-            face_db = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            for face in faces:
-                box = face['box']
-                x, y, w, h = box
-                face_img = extract_face(img, box)
-                emb = get_embedding(face_img)
-                best, best_score = None, -1
-                for rec in face_db:
-                    stored = np.array(list(map(float, rec['embedding'].split(','))))
-                    score = cosine_similarity(emb, stored)
-                    if score > best_score:
-                        best_score = score
-                        best = rec['student_id']
-                if(best_score>0.76):
-                    print(best_score)
-                if best_score > 0.77: #matching score .62
-                    recognized.add(best)
-                    cv2.rectangle(img, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                    cv2.putText(img, best, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                else:
-                    cv2.rectangle(img, (x, y), (x+w, y+h), (0, 0, 255), 2)
-                    cv2.putText(img, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            return img
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            annotated_imgs = list(executor.map(process_photo, photos))
-        conn = DatabaseHelper.get_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT student_id FROM students")
-        all_students = {row['student_id'] for row in cursor.fetchall()}
-        cursor.close()
-        conn.close()
-        for student in all_students:
-            if student in recognized:
-                AttendanceManager.update_attendance(student, 'present')
-            else:
-                AttendanceManager.update_attendance(student, 'absent')
-        filenames = []
-        for idx, img in enumerate(annotated_imgs):
-            fname = f"attendance_{datetime.now().timestamp()}_{idx}.jpg"
-            path = os.path.join(app.config['UPLOAD_FOLDER'], fname)
-            cv2.imwrite(path, img)
-            filenames.append(fname)
-        flash(f"Attendance processed from uploaded photos. Recognized: {len(recognized)} students.", "success")
-        image_urls = [url_for('static', filename='uploads/' + f) for f in filenames]
+        if not app.config['ENABLE_RECOGNITION']:
+            flash("Face recognition is disabled on this server.", "danger")
+            return redirect(url_for('teacher_attendance'))
+        job_id = AttendanceJobManager.create(session['user']['username'], 'upload',
+                                             [photo.read() for photo in photos if photo.filename != ""],
+                                             scope=AttendanceJobManager.parse_scope(request.form.get('scope')))
+        return redirect(url_for('attendance_job', job_id=job_id))
+    return render_template('teacher_attendance.html', partitions=AttendanceManager.get_partitions())
+
+@app.route('/teacher/attendance/jobs/<job_id>')
+def attendance_job(job_id):
+    if 'user' not in session or session['user']['role'] != 'teacher':
+        flash("Access denied.", "danger")
+        return redirect(url_for('login'))
+    job = AttendanceJobManager.get(job_id)
+    if not job or job['username'] != session['user']['username']:
+        flash("Attendance job not found.", "danger")
+        return redirect(url_for('teacher_index'))
+    if job['status'] == 'done':
+        source = "live capture" if job['source'] == 'live' else "uploaded photos"
+        flash(f"Attendance processed from {source}. Recognized: {job['recognized_count']} students.", "success")
+        image_urls = [url_for('static', filename='uploads/' + f) for f in json.loads(job['result_images'] or '[]')]
         return render_template('attendance_result.html', image_urls=image_urls)
-    return render_template('teacher_attendance.html')
+    return render_template('attendance_job.html', job=job)
+
+@app.route('/teacher/attendance/jobs/<job_id>/status')
+def attendance_job_status(job_id):
+    if 'user' not in session or session['user']['role'] != 'teacher':
+        return {'error': 'Access denied.'}, 403
+    job = AttendanceJobManager.get(job_id)
+    if not job or job['username'] != session['user']['username']:
+        return {'error': 'Attendance job not found.'}, 404
+    return {
+        'status': job['status'],
+        'processed': job['processed_photos'],
+        'total': job['total_photos'],
+        'error': job['error'],
+    }
 
 # ---------------- Attendance Result ----------------
 @app.route('/attendance_result')
@@ -800,27 +1461,108 @@ def show_attendance_view():
     if start_time and not end_time:
         end_time = current_time
     records = AttendanceManager.get_records(start_date, end_date, start_time, end_time)
-    grouped = {}
-    for rec in records:
-        rec_date = rec['timestamp'].strftime("%d-%m-%Y")
-        if rec_date not in grouped:
-            grouped[rec_date] = []
-        if not any(r['student_id'] == rec['student_id'] for r in grouped[rec_date]):
-            grouped[rec_date].append(rec)
-        else:
-            existing = next(r for r in grouped[rec_date] if r['student_id'] == rec['student_id'])
-            if existing['status'] != 'present' and rec['status'] == 'present':
-                grouped[rec_date].remove(existing)
-                grouped[rec_date].append(rec)
+    grouped = AttendanceManager.group_by_day(records)
+    # Totals count the same LEFT JOIN rows as the table, so students with no
+    # attendance row in the range are included as absent.
     total = len(records)
     present = sum(1 for rec in records if rec['status'] == 'present')
     absent = total - present
     if absent < 0:
         absent = 0
-    summary = {'total': total, 'present': present, 'absent': absent}
+    summary = {'total': total, 'present': present, 'absent': absent, 'by_class': []}
+    if not (start_time and end_time):
+        # The daily rollup has no time-of-day breakdown; it covers recorded rows only.
+        summary['by_class'] = AttendanceManager.get_summary(start_date, end_date)['by_class']
     return render_template('show_attendance.html', grouped_records=grouped, summary=summary)
 
 # ---------------- Download Attendance ----------------
+class ExportTooLarge(Exception):
+    """The export has more rows than its format allows (see PDF_EXPORT_MAX_ROWS)."""
+
+class ExportManager:
+    """Writers for attendance exports that consume rows incrementally."""
+    COLUMNS = ['roll_number', 'name', 'branch', 'status', 'timestamp']
+    # Letter page layout: x offset of each column and row height in points.
+    PDF_COLUMN_X = [40, 120, 300, 400, 470]
+    PDF_ROW_HEIGHT = 18
+
+    @staticmethod
+    def csv_chunks(rows, chunk_rows=500):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(ExportManager.COLUMNS)
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % chunk_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    @staticmethod
+    def write_xlsx(rows, path):
+        # constant_memory flushes each row to disk as soon as the next one starts.
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Attendance')
+        header_format = workbook.add_format({
+            'bold': True,
+            'text_wrap': True,
+            'valign': 'middle',
+            'fg_color': '#D7E4BC',
+            'border': 1})
+        worksheet.write_row(0, 0, ExportManager.COLUMNS, header_format)
+        for row_num, row in enumerate(rows, 1):
+            worksheet.write_row(row_num, 0, row)
+        workbook.close()
+
+    @staticmethod
+    def _pdf_row(pdf, y, values, header=False):
+        width = letter[0] - 2 * ExportManager.PDF_COLUMN_X[0]
+        pdf.setFillColor(colors.grey if header else colors.beige)
+        pdf.rect(ExportManager.PDF_COLUMN_X[0], y, width, ExportManager.PDF_ROW_HEIGHT, stroke=1, fill=1)
+        pdf.setFillColor(colors.whitesmoke if header else colors.black)
+        pdf.setFont('Helvetica-Bold' if header else 'Helvetica', 9)
+        for x, value in zip(ExportManager.PDF_COLUMN_X, values):
+            pdf.drawString(x + 4, y + 5, str(value if value is not None else ''))
+
+    @staticmethod
+    def write_pdf(rows, path):
+        """
+        Draw the table page by page. The canvas keeps every finished page in
+        memory until save(), so exports past PDF_EXPORT_MAX_ROWS are refused.
+        """
+        pdf = canvas.Canvas(path, pagesize=letter)
+        top = letter[1] - 40
+        y = None
+        for i, row in enumerate(rows, 1):
+            if i > app.config['PDF_EXPORT_MAX_ROWS']:
+                rows.close()
+                raise ExportTooLarge(f"PDF exports are limited to {app.config['PDF_EXPORT_MAX_ROWS']} rows.")
+            if y is None or y < 40:
+                if y is not None:
+                    pdf.showPage()
+                y = top - ExportManager.PDF_ROW_HEIGHT
+                ExportManager._pdf_row(pdf, y, ExportManager.COLUMNS, header=True)
+            y -= ExportManager.PDF_ROW_HEIGHT
+            ExportManager._pdf_row(pdf, y, row)
+        if y is None:
+            ExportManager._pdf_row(pdf, top - ExportManager.PDF_ROW_HEIGHT, ExportManager.COLUMNS, header=True)
+        pdf.save()
+
+    @staticmethod
+    def send_temp_file(writer, rows, download_name):
+        """Render an export into a temporary file and stream it back, deleting it afterwards."""
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(download_name)[1])
+        os.close(fd)
+        try:
+            writer(rows, path)
+        except Exception:
+            os.remove(path)
+            raise
+        response = send_file(path, download_name=download_name, as_attachment=True)
+        response.call_on_close(lambda: os.remove(path))
+        return response
+
 @app.route('/download_attendance', methods=['GET'])
 def download_attendance_view():
     file_format = request.args.get('file_format', 'excel')
@@ -831,66 +1573,19 @@ def download_attendance_view():
     current_time = datetime.now().strftime("%H:%M:%S")
     if start_time and not end_time:
         end_time = current_time
-    conn = DatabaseHelper.get_connection()
-    cursor = conn.cursor(dictionary=True)
-    query = """
-        SELECT s.roll_number, s.name, s.branch,
-               COALESCE(a.status, 'absent') as status,
-               a.timestamp
-        FROM students s
-        LEFT JOIN attendance a ON s.student_id = a.student_id
-          AND DATE(a.timestamp) BETWEEN %s AND %s
-    """
-    params = [start_date, end_date]
-    if start_time and end_time:
-        query += " AND TIME(a.timestamp) BETWEEN %s AND %s"
-        params.extend([start_time, end_time])
-    query += " ORDER BY DATE(a.timestamp) ASC, CAST(s.roll_number AS UNSIGNED) ASC"
-    cursor.execute(query, params)
-    records = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    for rec in records:
-        if rec['timestamp'] is None:
-            rec['timestamp'] = datetime.strptime(start_date, "%Y-%m-%d")
-    df = pd.DataFrame(records)
-    if not df.empty:
-        df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime("%d-%m-%Y %I:%M %p")
-    if file_format == 'excel':
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Attendance')
-            workbook  = writer.book
-            worksheet = writer.sheets['Attendance']
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'middle',
-                'fg_color': '#D7E4BC',
-                'border': 1})
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-        output.seek(0)
-        return send_file(output, download_name="attendance.xlsx", as_attachment=True)
+    rows = AttendanceManager.iter_export_rows(start_date, end_date, start_time, end_time)
+    if file_format == 'csv':
+        return Response(stream_with_context(ExportManager.csv_chunks(rows)), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=attendance.csv'})
+    elif file_format == 'excel':
+        return ExportManager.send_temp_file(ExportManager.write_xlsx, rows, "attendance.xlsx")
     elif file_format == 'pdf':
-        output = io.BytesIO()
-        doc = SimpleDocTemplate(output, pagesize=letter)
-        data = [df.columns.tolist()] + df.values.tolist()
-        table = Table(data)
-        style = TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
-            ('ALIGN',(0,0),(-1,-1),'CENTER'),
-            ('FONTNAME',(0,0),(-1,0),'Helvetica-Bold'),
-            ('BOTTOMPADDING',(0,0),(-1,0),12),
-            ('BACKGROUND',(0,1),(-1,-1),colors.beige),
-            ('GRID',(0,0),(-1,-1),1,colors.black),
-        ])
-        table.setStyle(style)
-        elements = [table]
-        doc.build(elements)
-        output.seek(0)
-        return send_file(output, download_name="attendance.pdf", as_attachment=True)
+        try:
+            return ExportManager.send_temp_file(ExportManager.write_pdf, rows, "attendance.pdf")
+        except ExportTooLarge as e:
+            flash(f"{e} Download CSV or Excel for this range.", "warning")
+            return redirect(url_for('show_attendance_view', start_date=start_date, end_date=end_date,
+                                    start_time=start_time, end_time=end_time))
     else:
         flash("Invalid file format requested.", "danger")
         return redirect(url_for('show_attendance_view'))
@@ -911,6 +1606,9 @@ def request_registration():
         if not all(files) or any(f.filename == "" for f in files):
             flash("Please upload exactly three photos for registration request.", "warning")
             return redirect(url_for('request_registration'))
+        if not app.config['ENABLE_RECOGNITION']:
+            flash("Face recognition is disabled on this server.", "danger")
+            return redirect(url_for('request_registration'))
         photo_urls = []
         for file in files:
             image = np.array(Image.open(file.stream).convert('RGB'))
@@ -933,6 +1631,189 @@ def request_registration():
         return redirect(url_for('teacher_index'))
     return render_template('request_registration.html')
 
+# ================= Migrations =================
+@app.cli.command('migrate-embeddings')
+def migrate_embeddings():
+    """Convert student_faces.embedding from comma-separated TEXT to binary float32."""
+    batch_size = 500
+    conn = DatabaseHelper.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='student_faces'")
+    columns = {row['COLUMN_NAME']: row['DATA_TYPE'] for row in cursor.fetchall()}
+    if columns.get('embedding') in ('varbinary', 'blob'):
+        print("student_faces.embedding is already binary.")
+        cursor.close()
+        conn.close()
+        return
+    if 'embedding_bin' not in columns:
+        cursor.execute("ALTER TABLE student_faces "
+                       "ADD COLUMN embedding_bin VARBINARY(2048) NULL AFTER embedding, "
+                       "ADD COLUMN embedding_dim SMALLINT NOT NULL DEFAULT 128 AFTER embedding_bin, "
+                       "ADD COLUMN model_version VARCHAR(32) NOT NULL DEFAULT 'facenet_keras' AFTER embedding_dim")
+    cursor.execute("SELECT id, embedding FROM student_faces WHERE embedding_bin IS NULL")
+    rows = cursor.fetchall()
+    conn.autocommit = False
+    converted = 0
+    for start in range(0, len(rows), batch_size):
+        batch = []
+        for row in rows[start:start + batch_size]:
+            vector = np.array(row['embedding'].split(','), dtype=np.float32) if row['embedding'] else np.zeros(0)
+            batch.append((row['id'], encode_embedding(vector), len(vector), EMBEDDING_MODEL_VERSION))
+        # A multi-row INSERT ... ON DUPLICATE KEY UPDATE updates the whole batch in one statement.
+        cursor.executemany("INSERT INTO student_faces (id, embedding_bin, embedding_dim, model_version) VALUES (%s, %s, %s, %s) "
+                           "ON DUPLICATE KEY UPDATE embedding_bin=VALUES(embedding_bin), "
+                           "embedding_dim=VALUES(embedding_dim), model_version=VALUES(model_version)", batch)
+        conn.commit()
+        converted += len(batch)
+    conn.autocommit = True
+    cursor.execute("ALTER TABLE student_faces DROP COLUMN embedding, "
+                   "CHANGE COLUMN embedding_bin embedding VARBINARY(2048) NOT NULL")
+    cursor.close()
+    conn.close()
+    print(f"Converted {converted} embeddings to binary float32.")
+
+@app.cli.command('migrate-attendance-keys')
+def migrate_attendance_keys():
+    """Collapse duplicate per-day attendance rows and add the unique (student_id, attendance_date) key."""
+    conn = DatabaseHelper.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='attendance' AND COLUMN_NAME='attendance_date'")
+    if cursor.fetchone()[0]:
+        print("attendance.attendance_date already exists.")
+        cursor.close()
+        conn.close()
+        return
+    # Keep one row per student and day: a 'present' row wins, otherwise the earliest one.
+    cursor.execute("""
+        DELETE a FROM attendance a
+        JOIN attendance b ON a.student_id = b.student_id
+          AND DATE(a.timestamp) = DATE(b.timestamp)
+          AND ((b.status = 'present' AND a.status <> 'present')
+               OR ((b.status = 'present') = (a.status = 'present') AND b.id < a.id))
+    """)
+    removed = cursor.rowcount
+    cursor.execute("ALTER TABLE attendance "
+                   "ADD COLUMN attendance_date DATE AS (DATE(timestamp)) STORED, "
+                   "ADD UNIQUE KEY uq_attendance_student_date (student_id, attendance_date)")
+    cursor.close()
+    conn.close()
+    print(f"Removed {removed} duplicate attendance rows and added uq_attendance_student_date.")
+
+@app.cli.command('migrate-attendance-indexes')
+def migrate_attendance_indexes():
+    """Add the generated attendance_time column and the date-first composite index."""
+    conn = DatabaseHelper.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='attendance' AND COLUMN_NAME='attendance_time'")
+    if cursor.fetchone()[0]:
+        print("attendance.attendance_time already exists.")
+    else:
+        cursor.execute("ALTER TABLE attendance "
+                       "ADD COLUMN attendance_time TIME AS (TIME(timestamp)) STORED AFTER attendance_date, "
+                       "ADD INDEX idx_attendance_date_student (attendance_date, student_id)")
+        print("Added attendance.attendance_time and idx_attendance_date_student.")
+    cursor.close()
+    conn.close()
+
+@app.cli.command('migrate-attendance-scope')
+def migrate_attendance_scope():
+    """Add the branch/class scope columns to attendance_jobs and the students partition index."""
+    conn = DatabaseHelper.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='attendance_jobs' AND COLUMN_NAME='branch'")
+    if cursor.fetchone()[0]:
+        print("attendance_jobs.branch already exists.")
+    else:
+        cursor.execute("ALTER TABLE attendance_jobs ADD COLUMN branch VARCHAR(50) AFTER source, "
+                       "ADD COLUMN class VARCHAR(50) AFTER branch")
+        print("Added attendance_jobs.branch and attendance_jobs.class.")
+    cursor.execute("SELECT COUNT(*) FROM information_schema.STATISTICS "
+                   "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='students' AND INDEX_NAME='idx_students_branch_class'")
+    if cursor.fetchone()[0]:
+        print("idx_students_branch_class already exists.")
+    else:
+        cursor.execute("ALTER TABLE students ADD INDEX idx_students_branch_class (branch, class)")
+        print("Added idx_students_branch_class.")
+    cursor.close()
+    conn.close()
+
+@app.cli.command('migrate-attendance-job-attempts')
+def migrate_attendance_job_attempts():
+    """Add the attempts counter used to retry attendance jobs after transient failures."""
+    conn = DatabaseHelper.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='attendance_jobs' AND COLUMN_NAME='attempts'")
+    if cursor.fetchone()[0]:
+        print("attendance_jobs.attempts already exists.")
+    else:
+        cursor.execute("ALTER TABLE attendance_jobs ADD COLUMN attempts INT NOT NULL DEFAULT 0 AFTER status")
+        print("Added attendance_jobs.attempts.")
+    cursor.close()
+    conn.close()
+
+@app.cli.command('rebuild-attendance-rollup')
+def rebuild_attendance_rollup():
+    """Rebuild attendance_daily_summary from scratch (backfill or repair)."""
+    conn = DatabaseHelper.get_connection()
+    cursor = conn.cursor()
+    conn.start_transaction()
+    cursor.execute("DELETE FROM attendance_daily_summary")
+    cursor.execute("""
+        INSERT INTO attendance_daily_summary (attendance_date, branch, class, present, absent)
+        SELECT a.attendance_date, COALESCE(s.branch, ''), COALESCE(s.class, ''),
+               SUM(a.status = 'present'), SUM(a.status <> 'present')
+        FROM attendance a JOIN students s ON s.student_id = a.student_id
+        WHERE a.attendance_date IS NOT NULL
+        GROUP BY a.attendance_date, COALESCE(s.branch, ''), COALESCE(s.class, '')
+    """)
+    rows = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Rebuilt attendance_daily_summary with {rows} rows.")
+
+# ================= Server Startup =================
+# Importing this module starts nothing, so CLI commands and scripts never
+# spawn inference workers or claim queued attendance jobs. Serving
+# processes start their background work once: `python app.py` before it
+# listens, any other server on the first request.
+_serving_lock = threading.Lock()
+_serving_started = False
+
+def start_serving(wait=True):
+    """Warm the inference pool and resume unfinished attendance jobs; later calls do nothing."""
+    global _serving_started
+    with _serving_lock:
+        if _serving_started:
+            return
+        _serving_started = True
+    # Workers started with ENABLE_RECOGNITION off never import TensorFlow at all.
+    if app.config['ENABLE_RECOGNITION'] and app.config['WARMUP_ON_STARTUP']:
+        if wait:
+            inference_pool.start()
+        else:
+            # /healthz reports warming_up until the pool is ready.
+            threading.Thread(target=inference_pool.start, daemon=True).start()
+    if app.config['ENABLE_RECOGNITION']:
+        # Pick up jobs a previous process accepted but never finished, and keep watching
+        # for jobs whose process dies (e.g. a restart or deploy of another worker).
+        AttendanceJobManager.resume_pending()
+        threading.Thread(target=AttendanceJobManager.watch, args=(app.config['ATTENDANCE_JOB_HEARTBEAT'],),
+                         daemon=True).start()
+
+@app.before_request
+def ensure_serving():
+    if not _serving_started:
+        start_serving(wait=False)
+
 if __name__ == '__main__':
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_serving()
     app.run(debug=True)
     # app.run(debug=True, host='0.0.0.0' , ssl_context=('Deploy/cert.pem', 'Deploy/key.pem'))
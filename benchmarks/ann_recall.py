@@ -0,0 +1,73 @@
+"""
+Recall and latency of the IVF gallery index against the exact scan.
+
+Uses a synthetic gallery shaped like real enrollment data (3 noisy
+embeddings per student) unless --rows points at an .npy file of real
+embeddings. Run from the repository root:
+
+    python -m benchmarks.ann_recall --students 30000 --queries 500
+"""
+import argparse
+import time
+
+import numpy as np
+
+from models.ann_index import IVFIndex
+from models.gallery import EmbeddingGallery, normalize_rows
+
+
+def synthetic_gallery(students, per_student, dim, noise, rng):
+    centers = normalize_rows(rng.normal(size=(students, dim)))
+    embeddings = np.repeat(centers, per_student, axis=0) + noise * rng.normal(size=(students * per_student, dim)) / np.sqrt(dim)
+    return np.repeat(np.arange(students), per_student), normalize_rows(embeddings), centers
+
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=30000)
+    parser.add_argument('--per-student', type=int, default=3)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--noise', type=float, default=0.6, help="query/enrollment noise relative to a unit vector")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nlist', type=int, default=0, help="0 = about 4*sqrt(gallery size)")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument('--rows', help="optional .npy file with real (N, dim) embeddings; queries are perturbed rows")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.rows:
+        embeddings = normalize_rows(np.load(args.rows))
+        ids = np.arange(len(embeddings))
+        picks = rng.choice(len(embeddings), args.queries, replace=False)
+        queries = normalize_rows(embeddings[picks] + args.noise * rng.normal(size=(args.queries, embeddings.shape[1])) / np.sqrt(embeddings.shape[1]))
+    else:
+        ids, embeddings, centers = synthetic_gallery(args.students, args.per_student, args.dim, args.noise, rng)
+        picks = rng.choice(len(centers), args.queries, replace=False)
+        queries = normalize_rows(centers[picks] + args.noise * rng.normal(size=(args.queries, args.dim)) / np.sqrt(args.dim))
+
+    flat = EmbeddingGallery(ids, embeddings)
+    (exact_idx, _), flat_time = timed(lambda: flat.top_k(queries, 1))
+    print(f"gallery: {len(flat)} embeddings, {len(queries)} queries")
+    print(f"flat scan: {1000 * flat_time / len(queries):.3f} ms/query")
+
+    index, build_time = timed(lambda: IVFIndex.build(flat.embeddings, nlist=args.nlist or None), repeat=1)
+    print(f"ivf build: {build_time:.2f} s, nlist={len(index.centroids)}")
+    print(f"{'nprobe':>6} {'recall@1':>9} {'ms/query':>9} {'speedup':>8}")
+    for nprobe in args.nprobe:
+        index.nprobe = min(nprobe, len(index.centroids))
+        (idx, _), ivf_time = timed(lambda: index.search(flat.embeddings, queries, 1))
+        recall = float(np.mean(idx[:, 0] == exact_idx[:, 0]))
+        print(f"{index.nprobe:>6} {recall:>9.3f} {1000 * ivf_time / len(queries):>9.3f} {flat_time / ivf_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Memory and match-decision drift of compact gallery storage (float16, int8)
+against the float32 gallery.
+
+Queries are a mix of enrolled students seen under noise and impostors, and
+decisions are compared at the live (0.7) and upload (0.77) thresholds.
+Re-ranking reads the float32 rows through a memory map, as the app does
+from the gallery store; MB/10k counts process memory only. Run from the
+repository root:
+
+    python -m benchmarks.gallery_quantization --students 10000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from models.gallery import EmbeddingGallery, normalize_rows
+
+THRESHOLDS = (0.7, 0.77)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--per-student', type=int, default=3)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--noise', type=float, default=0.7, help="noise norm relative to a unit vector")
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--impostors', type=float, default=0.2, help="fraction of queries from unenrolled people")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = normalize_rows(rng.normal(size=(args.students, args.dim)))
+    ids = np.array([f"S{i:06d}" for i in np.repeat(np.arange(args.students), args.per_student)], dtype=object)
+    noise = lambda n: args.noise * rng.normal(size=(n, args.dim)) / np.sqrt(args.dim)
+    embeddings = np.repeat(centers, args.per_student, axis=0) + noise(len(ids))
+    genuine = int(args.queries * (1 - args.impostors))
+    queries = np.concatenate([
+        centers[rng.choice(args.students, genuine, replace=False)] + noise(genuine),
+        normalize_rows(rng.normal(size=(args.queries - genuine, args.dim))),
+    ])
+
+    per_10k = 10000 / args.students
+    exact_dir = tempfile.mkdtemp()
+    exact_path = os.path.join(exact_dir, 'exact.npy')
+    np.save(exact_path, normalize_rows(embeddings))
+    exact = np.load(exact_path, mmap_mode='r')
+    baseline = EmbeddingGallery(ids, embeddings, shortlist=0)
+    reference = {t: baseline.match(queries, t) for t in THRESHOLDS}
+    print(f"gallery: {args.students} students x {args.per_student}, {len(queries)} queries "
+          f"({args.queries - genuine} impostors)")
+    print(f"{'storage':>8} {'rerank':>6} {'MB/10k':>7} {'changed@0.7':>12} {'changed@0.77':>13} {'max |dscore|':>13} {'ms/query':>9}")
+    for storage in ('float32', 'float16', 'int8'):
+        for rerank in ((False,) if storage == 'float32' else (False, True)):
+            gallery = EmbeddingGallery(ids, embeddings, shortlist=0, storage=storage, exact=exact if rerank else None)
+            start = time.perf_counter()
+            results = {t: gallery.match(queries, t) for t in THRESHOLDS}
+            elapsed = (time.perf_counter() - start) / len(THRESHOLDS)
+            changed = [sum(a[0] != b[0] for a, b in zip(results[t], reference[t])) for t in THRESHOLDS]
+            drift = max(abs(a[1] - b[1]) for a, b in zip(results[THRESHOLDS[0]], reference[THRESHOLDS[0]]))
+            print(f"{storage:>8} {str(rerank):>6} {gallery.nbytes * per_10k / 2**20:>7.2f} {changed[0]:>12} "
+                  f"{changed[1]:>13} {drift:>13.5f} {1000 * elapsed / len(queries):>9.4f}")
+    del exact, gallery
+    shutil.rmtree(exact_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
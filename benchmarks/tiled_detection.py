@@ -0,0 +1,128 @@
+"""
+Recall and latency of tiled face detection against whole-image detection
+(at full resolution and downscaled) on large lecture-hall frames.
+
+With --faces, a synthetic hall is composed from the face photos in that
+directory: rows of faces shrinking from --front to --back pixels towards
+the top of the frame, so ground truth is known exactly. With --image, a
+real photo is used and full-resolution detection is the reference. Needs
+MTCNN installed. Run from the repository root:
+
+    python -m benchmarks.tiled_detection --faces static/uploads --width 6000 --height 4000
+    python -m benchmarks.tiled_detection --image hall.jpg --tile-size 1024 768
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from models.face_recognition import detect, iou_matrix, warm_up
+
+
+def load_face_crops(directory, rng):
+    """Largest detected face of every photo in `directory`, as RGB crops."""
+    crops = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        faces = detect(image)
+        if len(faces):
+            x, y, w, h = faces.boxes[np.argmax(faces.boxes[:, 2] * faces.boxes[:, 3])]
+            pad_w, pad_h = w // 4, h // 4
+            crops.append(image[max(0, y - pad_h):y + h + pad_h, max(0, x - pad_w):x + w + pad_w])
+    rng.shuffle(crops)
+    return crops
+
+
+def synthetic_hall(crops, width, height, front, back, rng):
+    """Compose a hall frame; returns (image, ground-truth boxes) with face sizes interpolated per row."""
+    image = np.full((height, width, 3), 90, dtype=np.uint8)
+    image += rng.integers(0, 40, size=image.shape, dtype=np.uint8)
+    boxes, y, k = [], height, 0
+    while True:
+        size = int(back + (front - back) * y / height)
+        y -= int(size * 2.2)
+        if y < 0:
+            break
+        for x in range(size // 2, width - 2 * size, int(size * 2.2)):
+            crop = crops[k % len(crops)]
+            k += 1
+            scale = size / (crop.shape[1] / 1.5)
+            patch = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                               interpolation=cv2.INTER_AREA)
+            ph, pw = patch.shape[:2]
+            if y + ph > height or x + pw > width:
+                continue
+            image[y:y + ph, x:x + pw] = patch
+            # The face itself sits in the middle two thirds of the padded crop.
+            boxes.append([x + pw // 6, y + ph // 6, pw * 2 // 3, ph * 2 // 3])
+    return image, np.array(boxes, dtype=np.int32).reshape(-1, 4)
+
+
+def score(found, truth, iou_threshold):
+    if not len(truth):
+        return float('nan'), 0
+    if not len(found):
+        return 0.0, 0
+    overlaps = iou_matrix(truth, found.boxes)
+    recall = float(np.mean(overlaps.max(axis=1) >= iou_threshold))
+    false_positives = int(np.sum(overlaps.max(axis=0) < iou_threshold))
+    return recall, false_positives
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--faces', help="directory of face photos to compose a synthetic hall from")
+    source.add_argument('--image', help="real hall photo; full-resolution detection is the reference")
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--front', type=int, default=120, help="face size (px) in the front row")
+    parser.add_argument('--back', type=int, default=22, help="face size (px) in the back row")
+    parser.add_argument('--max-side', type=int, nargs='+', default=[1600, 2400])
+    parser.add_argument('--tile-size', type=int, nargs='+', default=[768, 1024])
+    parser.add_argument('--overlap', type=int, default=160)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--min-confidence', type=float, default=0.9)
+    parser.add_argument('--iou', type=float, default=0.4, help="IoU for a detection to count as a hit")
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    warm_up()
+    if args.faces:
+        image, truth = synthetic_hall(load_face_crops(args.faces, rng), args.width, args.height,
+                                      args.front, args.back, rng)
+    else:
+        image = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2RGB)
+        truth = None
+
+    runs = [('full resolution', {})]
+    runs += [(f"downscaled {side}", {'max_side': side}) for side in args.max_side]
+    runs += [(f"tiled {tile}/{args.overlap} x{workers}",
+              {'tile_size': tile, 'tile_overlap': args.overlap, 'tile_workers': workers})
+             for tile in args.tile_size for workers in args.workers]
+
+    print(f"frame: {image.shape[1]}x{image.shape[0]}"
+          + (f", {len(truth)} faces of {args.back}-{args.front} px" if truth is not None else ""))
+    print(f"{'mode':>24} {'faces':>6} {'recall':>7} {'false+':>7} {'seconds':>8}")
+    for name, options in runs:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            found = detect(image, min_confidence=args.min_confidence, **options)
+            best = min(best, time.perf_counter() - start)
+        if truth is None:
+            # The first run is full resolution: it becomes the reference for the rest.
+            truth = found.boxes
+        recall, false_positives = score(found, truth, args.iou)
+        print(f"{name:>24} {len(found):>6} {recall:>7.3f} {false_positives:>7} {best:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
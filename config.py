@@ -10,4 +10,76 @@ class Config:
     MYSQL_USER = os.environ.get('MYSQL_USER', params['db_user'])
     MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD', params['db_pass'])
     MYSQL_DB = os.environ.get('MYSQL_DB', params['db_name'])
+    # Connections kept open per process, how long a request waits for one,
+    # and how long a connection may sit idle before it is pinged on checkout.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_HEALTH_CHECK_INTERVAL', 30))
+    # Rows per page on admin listings (overridable with ?per_page= up to MAX_PAGE_SIZE).
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'static', 'uploads')
+    # Number of face crops sent through FaceNet per inference call.
+    EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 32))
+    # Attendance report results cached per process (entries) and for how long (seconds).
+    REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 256))
+    REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', 60))
+    # Rows fetched from the database per round trip when streaming attendance exports.
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+    # reportlab keeps every PDF page in memory until the file is saved; larger exports must use CSV/Excel.
+    PDF_EXPORT_MAX_ROWS = int(os.environ.get('PDF_EXPORT_MAX_ROWS', 5000))
+    # Students whose prototype (mean enrollment embedding) scores best are re-ranked against
+    # their individual embeddings; 0 scores every embedding directly.
+    GALLERY_SHORTLIST = int(os.environ.get('GALLERY_SHORTLIST', 5))
+    # Resident form of the gallery matrix: 'float32', 'float16' (1/2 the memory) or 'int8'
+    # (about 1/4, with per-vector scales). GALLERY_EXACT_RERANK=1 also writes float32 copies to
+    # the shared gallery store (requires GALLERY_STORE_DIR) to re-score the best compact candidates exactly.
+    GALLERY_STORAGE = os.environ.get('GALLERY_STORAGE', 'float32')
+    GALLERY_EXACT_RERANK = os.environ.get('GALLERY_EXACT_RERANK', '0') == '1'
+    # Directory for the shared memory-mapped gallery files (empty = each process loads its own copy),
+    # and how often workers check it for a newer version (seconds).
+    GALLERY_STORE_DIR = os.environ.get('GALLERY_STORE_DIR', '')
+    GALLERY_STORE_CHECK_INTERVAL = float(os.environ.get('GALLERY_STORE_CHECK_INTERVAL', 1.0))
+    # Without GALLERY_STORE_DIR, seconds between checks of the gallery_version row, which
+    # tells each worker process that another one changed enrollment.
+    GALLERY_VERSION_CHECK_INTERVAL = float(os.environ.get('GALLERY_VERSION_CHECK_INTERVAL', 1.0))
+    # Gallery search: 'flat' scans every enrollment embedding, 'ivf' uses the approximate
+    # index in models/ann_index.py once the gallery has IVF_MIN_GALLERY_SIZE embeddings.
+    GALLERY_INDEX = os.environ.get('GALLERY_INDEX', 'flat')
+    IVF_MIN_GALLERY_SIZE = int(os.environ.get('IVF_MIN_GALLERY_SIZE', 20000))
+    # Coarse lists (0 = about 4*sqrt(gallery size)) and lists visited per query.
+    IVF_NLIST = int(os.environ.get('IVF_NLIST', 0))
+    IVF_NPROBE = int(os.environ.get('IVF_NPROBE', 16))
+    # Attendance photos whose longer edge exceeds this are detected on a downscaled copy
+    # (boxes are mapped back and faces cropped from the original); 0 = full resolution (default).
+    DETECTION_MAX_SIDE = int(os.environ.get('DETECTION_MAX_SIDE', 0))
+    # Smallest face MTCNN searches for, in pixels of the (downscaled) detection image; 0 = MTCNN default.
+    DETECTION_MIN_FACE_SIZE = int(os.environ.get('DETECTION_MIN_FACE_SIZE', 0))
+    # Tiled detection for very large (lecture-hall) photos: MTCNN runs at full resolution on
+    # overlapping tiles of this size, TILE_WORKERS at a time (each tile thread loads its own
+    # MTCNN; 1 = tiles in order on the shared detector); 0 = off. The overlap should exceed
+    # the largest face expected away from the camera (larger faces come from a downscaled pass).
+    DETECTION_TILE_SIZE = int(os.environ.get('DETECTION_TILE_SIZE', 0))
+    DETECTION_TILE_OVERLAP = int(os.environ.get('DETECTION_TILE_OVERLAP', 160))
+    DETECTION_TILE_WORKERS = int(os.environ.get('DETECTION_TILE_WORKERS', 2))
+    # Set to 0 for admin/report-only workers: the ML stack is then never loaded.
+    ENABLE_RECOGNITION = os.environ.get('ENABLE_RECOGNITION', '1') == '1'
+    # Run MTCNN and FaceNet on dummy input when the server starts so the first request is not slow.
+    WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', '1') == '1'
+    # Attendance photos are processed by this many inference processes (0 = in the request thread).
+    INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 2))
+    # Photos that may be queued or in flight in the pool at once. Attendance jobs wait for a
+    # free slot, so a full queue delays jobs rather than rejecting uploads.
+    INFERENCE_QUEUE_DEPTH = int(os.environ.get('INFERENCE_QUEUE_DEPTH', 64))
+    # Background threads running queued attendance jobs.
+    ATTENDANCE_JOB_THREADS = int(os.environ.get('ATTENDANCE_JOB_THREADS', 2))
+    # Serving processes bump updated_at of their running jobs this often (seconds). A running
+    # job with no heartbeat for STALE_SECONDS is assumed orphaned and re-queued by any process.
+    ATTENDANCE_JOB_HEARTBEAT = int(os.environ.get('ATTENDANCE_JOB_HEARTBEAT', 30))
+    ATTENDANCE_JOB_STALE_SECONDS = int(os.environ.get('ATTENDANCE_JOB_STALE_SECONDS', 120))
+    # Jobs failing for a transient reason (crashed inference worker, database deadlock or
+    # outage) are re-run up to this many times in total, RETRY_DELAY * attempt seconds apart.
+    ATTENDANCE_JOB_MAX_ATTEMPTS = int(os.environ.get('ATTENDANCE_JOB_MAX_ATTEMPTS', 3))
+    ATTENDANCE_JOB_RETRY_DELAY = float(os.environ.get('ATTENDANCE_JOB_RETRY_DELAY', 10))
+    # Raw photos of queued attendance jobs; kept outside static/ so they are never served.
+    ATTENDANCE_JOB_DIR = os.environ.get('ATTENDANCE_JOB_DIR', os.path.join(os.getcwd(), 'instance', 'attendance_jobs'))
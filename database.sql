@@ -25,27 +25,55 @@ CREATE TABLE IF NOT EXISTS students (
     name VARCHAR(100) NOT NULL,
     branch VARCHAR(50),
     class VARCHAR(50),
-    roll_number VARCHAR(20)
+    roll_number VARCHAR(20),
+    -- Attendance sessions are scoped to one branch/class
+    INDEX idx_students_branch_class (branch, class)
 );
 
 -- Student faces table (each student registration requires exactly three photos)
 CREATE TABLE IF NOT EXISTS student_faces (
     id INT AUTO_INCREMENT PRIMARY KEY,
     student_id VARCHAR(20),
-    embedding TEXT,
+    embedding VARBINARY(2048) NOT NULL,   -- raw little-endian float32 vector
+    embedding_dim SMALLINT NOT NULL DEFAULT 128,
+    model_version VARCHAR(32) NOT NULL DEFAULT 'facenet_keras',
     image_path VARCHAR(255),
     FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE
 );
 
+-- Bumped by every enrollment change so each worker process knows to reload its in-memory gallery
+CREATE TABLE IF NOT EXISTS gallery_version (
+    id TINYINT PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+INSERT IGNORE INTO gallery_version (id, version) VALUES (1, 0);
+
 -- Attendance table with cascade deletion
 CREATE TABLE IF NOT EXISTS attendance (
     id INT AUTO_INCREMENT PRIMARY KEY,
     student_id VARCHAR(20),
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
     status VARCHAR(20),
+    -- Generated so reports can filter with plain range predicates that use the indexes below
+    attendance_date DATE AS (DATE(timestamp)) STORED,
+    attendance_time TIME AS (TIME(timestamp)) STORED,
+    -- One row per student per day; attendance is written with INSERT ... ON DUPLICATE KEY UPDATE
+    UNIQUE KEY uq_attendance_student_date (student_id, attendance_date),
+    INDEX idx_attendance_date_student (attendance_date, student_id),
     FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE
 );
 
+-- Per-day attendance totals per branch/class, kept in sync by the app on every attendance write
+-- (rebuild with: flask --app app rebuild-attendance-rollup)
+CREATE TABLE IF NOT EXISTS attendance_daily_summary (
+    attendance_date DATE NOT NULL,
+    branch VARCHAR(50) NOT NULL DEFAULT '',
+    class VARCHAR(50) NOT NULL DEFAULT '',
+    present INT NOT NULL DEFAULT 0,
+    absent INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (attendance_date, branch, class)
+);
+
 -- Student registration requests (submitted by teachers)
 CREATE TABLE IF NOT EXISTS student_requests (
   request_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -59,3 +87,22 @@ CREATE TABLE IF NOT EXISTS student_requests (
   photo3 VARCHAR(255),
   status ENUM('pending','approved','rejected') DEFAULT 'pending'
 );
+
+-- Background attendance jobs (photos are kept under ATTENDANCE_JOB_DIR/<job_id>/, outside static/, until the job is done or has failed for good)
+CREATE TABLE IF NOT EXISTS attendance_jobs (
+  job_id CHAR(32) PRIMARY KEY,
+  username VARCHAR(50) NOT NULL,
+  source ENUM('live','upload') NOT NULL,
+  branch VARCHAR(50),   -- session scope; NULL = all students
+  class VARCHAR(50),
+  status ENUM('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  attempts INT NOT NULL DEFAULT 0,   -- runs so far; transient failures are retried up to ATTENDANCE_JOB_MAX_ATTEMPTS
+  total_photos INT NOT NULL,
+  processed_photos INT NOT NULL DEFAULT 0,
+  recognized_count INT,
+  result_images TEXT,
+  error VARCHAR(255),
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  INDEX idx_attendance_jobs_status (status, updated_at)
+);
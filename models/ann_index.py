@@ -0,0 +1,118 @@
+import numpy as np
+
+
+def _assign(matrix, centroids, chunk=8192):
+    """Index of the most similar centroid for every row, computed in chunks to bound memory."""
+    out = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), chunk):
+        out[start:start + chunk] = np.argmax(matrix[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(matrix, nlist, iterations=10, sample_size=None, seed=0):
+    """
+    Spherical k-means over L2-normalized rows: returns `nlist` unit-norm
+    centroids. Training runs on a random sample (64 points per list by
+    default) since centroid quality saturates long before the full gallery.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or nlist * 64
+    if len(matrix) > sample_size:
+        matrix = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+    nlist = min(nlist, len(matrix))
+    centroids = matrix[rng.choice(len(matrix), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _assign(matrix, centroids)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=nlist)
+        nonempty = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.add.reduceat(matrix[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums
+        # Re-seed empty lists with random points so every list stays in use.
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = matrix[rng.choice(len(matrix), len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted-file index over a gallery matrix of normalized embeddings.
+
+    Rows are bucketed by their nearest coarse centroid. A query scores the
+    centroids, visits the `nprobe` best lists and re-ranks that shortlist
+    exactly against the full vectors. The index holds only centroids and
+    list assignments; the vectors themselves stay in the gallery and are
+    passed to `search`. Like the gallery it is immutable: `updated` returns a
+    new index for an add/remove without retraining, and retrains once the
+    gallery has grown or shrunk well past the size it was trained on.
+    """
+
+    RETRAIN_FACTOR = 2.0
+
+    def __init__(self, centroids, assignments, nprobe=8, trained_size=None):
+        self.centroids = centroids
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.nprobe = max(1, min(nprobe, len(centroids)))
+        self.trained_size = trained_size if trained_size is not None else len(self.assignments)
+        self._order = np.argsort(self.assignments, kind='stable')
+        counts = np.bincount(self.assignments, minlength=len(centroids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @classmethod
+    def build(cls, matrix, nlist=None, nprobe=8, iterations=10):
+        """Train centroids on `matrix` and assign every row; nlist defaults to ~4*sqrt(N)."""
+        nlist = nlist or max(1, int(4 * np.sqrt(len(matrix))))
+        centroids = train_centroids(matrix, nlist, iterations=iterations)
+        return cls(centroids, _assign(matrix, centroids), nprobe=nprobe, trained_size=len(matrix))
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def updated(self, keep, added):
+        """
+        Index for a gallery made of the rows selected by the boolean mask
+        `keep` followed by the normalized rows `added`, in that order.
+        """
+        assignments = self.assignments[keep]
+        if len(added):
+            assignments = np.concatenate([assignments, _assign(np.asarray(added, dtype=np.float32), self.centroids)])
+        size = len(assignments)
+        if size and not (self.trained_size / self.RETRAIN_FACTOR <= size <= self.trained_size * self.RETRAIN_FACTOR):
+            return None
+        return IVFIndex(self.centroids, assignments, nprobe=self.nprobe, trained_size=self.trained_size)
+
+    def candidates(self, query_centroid_scores):
+        """Row indices in the `nprobe` best lists for one query."""
+        nprobe = self.nprobe
+        if nprobe < len(self.centroids):
+            lists = np.argpartition(-query_centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            lists = np.arange(len(self.centroids))
+        return np.concatenate([self._order[self._offsets[l]:self._offsets[l + 1]] for l in lists])
+
+    def search(self, matrix, queries, k=1):
+        """
+        Return (indices, scores) of shape (len(queries), k), best first, for
+        normalized `queries` against gallery `matrix`. Slots with no candidate
+        have index -1 and score -inf.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        centroid_scores = queries @ self.centroids.T
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            cand = self.candidates(centroid_scores[i])
+            if not len(cand):
+                continue
+            exact = matrix[cand] @ query
+            kk = min(k, len(cand))
+            best = np.argpartition(-exact, kk - 1)[:kk] if kk < len(cand) else np.arange(len(cand))
+            best = best[np.argsort(-exact[best])]
+            indices[i, :kk] = cand[best]
+            scores[i, :kk] = exact[best]
+        return indices, scores
@@ -1,21 +1,347 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import cv2
-from mtcnn import MTCNN
-from keras.models import load_model
 from numpy.linalg import norm
 
-# Initialize MTCNN for face detection
-detector = MTCNN()
+from utils.image_processing import resize_image
 
-# Load the pre-trained FaceNet model.
+# TensorFlow, Keras and MTCNN are imported and the models built on first use,
+# so processes that never run recognition do not pay for the ML stack.
 FACENET_MODEL_PATH = 'models/facenet_keras.h5'
-facenet_model = load_model(FACENET_MODEL_PATH)
 
-def detect_faces(image, min_confidence=0.95):
+# Stored alongside every enrollment embedding so vectors from a different
+# model (or dimension) are never compared against each other.
+EMBEDDING_MODEL_VERSION = 'facenet_keras'
+EMBEDDING_DIM = 128
+FACE_SIZE = (160, 160)
+
+# Batches are zero-padded up to one of these sizes so the compiled FaceNet
+# function only ever sees a fixed set of input shapes and never retraces.
+INFERENCE_BUCKETS = (1, 4, 8, 16, 32)
+
+_load_lock = threading.Lock()
+_tf = None
+# MTCNN detectors keyed by min_face_size (None = the library default).
+_detectors = {}
+# Tiled detection: one thread pool per worker count, and per-thread detectors,
+# since one Keras model is not safe to call from several threads at once.
+_tile_executors = {}
+_tile_local = threading.local()
+_facenet_model = None
+_facenet_forward = None
+
+def _import_tensorflow():
+    # Callers hold _load_lock.
+    global _tf
+    if _tf is None:
+        import tensorflow as tf
+        # Configure TensorFlow GPU memory growth
+        gpus = tf.config.experimental.list_physical_devices('GPU')
+        if gpus:
+            try:
+                for gpu in gpus:
+                    tf.config.experimental.set_memory_growth(gpu, True)
+            except RuntimeError as e:
+                print(e)
+        _tf = tf
+    return _tf
+
+def _build_detector(min_face_size):
+    # Callers hold _load_lock.
+    _import_tensorflow()
+    from mtcnn import MTCNN
+    return MTCNN() if min_face_size is None else MTCNN(min_face_size=min_face_size)
+
+def get_detector(min_face_size=None):
+    """Return the shared MTCNN detector for `min_face_size` (pixels), building it on first call."""
+    detector = _detectors.get(min_face_size)
+    if detector is None:
+        with _load_lock:
+            detector = _detectors.get(min_face_size)
+            if detector is None:
+                detector = _detectors[min_face_size] = _build_detector(min_face_size)
+    return detector
+
+def _thread_detector(min_face_size):
+    """MTCNN detector owned by the calling tile thread, built on its first tile."""
+    detectors = getattr(_tile_local, 'detectors', None)
+    if detectors is None:
+        detectors = _tile_local.detectors = {}
+    detector = detectors.get(min_face_size)
+    if detector is None:
+        with _load_lock:
+            detector = detectors[min_face_size] = _build_detector(min_face_size)
+    return detector
+
+def _tile_executor(workers):
+    """Long-lived pool of tile threads, so their detectors are built once per process."""
+    executor = _tile_executors.get(workers)
+    if executor is None:
+        with _load_lock:
+            executor = _tile_executors.get(workers)
+            if executor is None:
+                executor = _tile_executors[workers] = ThreadPoolExecutor(max_workers=workers,
+                                                                         thread_name_prefix='detect-tile')
+    return executor
+
+def get_facenet_model():
+    """Return the shared FaceNet model, loading it on first call."""
+    global _facenet_model
+    if _facenet_model is None:
+        with _load_lock:
+            if _facenet_model is None:
+                _import_tensorflow()
+                from keras.models import load_model
+                _facenet_model = load_model(FACENET_MODEL_PATH)
+    return _facenet_model
+
+def _get_facenet_forward():
+    global _facenet_forward
+    if _facenet_forward is None:
+        model = get_facenet_model()
+        with _load_lock:
+            if _facenet_forward is None:
+                tf = _import_tensorflow()
+                _facenet_forward = tf.function(lambda batch: model(batch, training=False), reduce_retracing=False)
+    return _facenet_forward
+
+def _bucket_size(n):
+    for size in INFERENCE_BUCKETS:
+        if size >= n:
+            return size
+    return INFERENCE_BUCKETS[-1]
+
+def _run_facenet(batch):
+    n = len(batch)
+    size = _bucket_size(n)
+    if size > n:
+        padded = np.zeros((size,) + batch.shape[1:], dtype='float32')
+        padded[:n] = batch
+        batch = padded
+    return _get_facenet_forward()(batch).numpy()[:n]
+
+def warm_up(min_face_size=None):
+    """
+    Load the models and run MTCNN and every FaceNet bucket once on dummy input,
+    so graph tracing and kernel selection happen at startup rather than on
+    the first request.
+    """
+    dummy_frame = np.random.default_rng(0).integers(0, 256, size=(240, 320, 3), dtype=np.uint8)
+    get_detector(min_face_size).detect_faces(dummy_frame)
+    for size in INFERENCE_BUCKETS:
+        _run_facenet(np.zeros((size,) + FACE_SIZE + (3,), dtype='float32'))
+
+# MTCNN landmark names, in the column order used by Detections.keypoints.
+KEYPOINT_NAMES = ('left_eye', 'right_eye', 'nose', 'mouth_left', 'mouth_right')
+
+class Detections:
+    """
+    Array form of a set of face detections: `boxes` (N, 4) int32 as
+    x, y, width, height; `scores` (N,) float32 confidences; `keypoints`
+    (N, 5, 2) float32 landmarks in KEYPOINT_NAMES order. Indexing with an
+    int array or boolean mask returns a new Detections.
+    """
+
+    def __init__(self, boxes, scores, keypoints):
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.keypoints = np.asarray(keypoints, dtype=np.float32).reshape(-1, len(KEYPOINT_NAMES), 2)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros((0, len(KEYPOINT_NAMES), 2)))
+
+    @classmethod
+    def from_dicts(cls, faces):
+        """Build from MTCNN-style dicts ('box', 'confidence', 'keypoints')."""
+        if not faces:
+            return cls.empty()
+        return cls(
+            [face['box'] for face in faces],
+            [face.get('confidence', 0) for face in faces],
+            [[face.get('keypoints', {}).get(name, (0, 0)) for name in KEYPOINT_NAMES] for face in faces],
+        )
+
+    def to_dicts(self):
+        """MTCNN-style dicts, for callers of the list-of-dicts API."""
+        return [
+            {
+                'box': [int(v) for v in box],
+                'confidence': float(score),
+                'keypoints': {name: (int(round(px)), int(round(py))) for name, (px, py) in zip(KEYPOINT_NAMES, points)},
+            }
+            for box, score, points in zip(self.boxes, self.scores, self.keypoints)
+        ]
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, idx):
+        return Detections(self.boxes[idx], self.scores[idx], self.keypoints[idx])
+
+    @classmethod
+    def concat(cls, parts):
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        return cls(np.concatenate([p.boxes for p in parts]), np.concatenate([p.scores for p in parts]),
+                   np.concatenate([p.keypoints for p in parts]))
+
+    def shifted(self, dx, dy):
+        """Detections translated by (dx, dy), e.g. from tile to frame coordinates."""
+        return Detections(self.boxes + np.array([dx, dy, 0, 0], dtype=np.int32), self.scores,
+                          self.keypoints + np.array([dx, dy], dtype=np.float32))
+
+    def clip(self, image_shape):
+        """Clip boxes to the image and drop those left with no area."""
+        boxes = clip_boxes(self.boxes, image_shape)
+        keep = (boxes[:, 2] > 0) & (boxes[:, 3] > 0)
+        return Detections(boxes[keep], self.scores[keep], self.keypoints[keep])
+
+def clip_boxes(boxes, image_shape):
+    """Clip (N, 4) x, y, w, h boxes to an image of shape (height, width, ...)."""
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    height, width = image_shape[:2]
+    x1 = np.clip(boxes[:, 0], 0, width)
+    y1 = np.clip(boxes[:, 1], 0, height)
+    x2 = np.clip(boxes[:, 0] + boxes[:, 2], 0, width)
+    y2 = np.clip(boxes[:, 1] + boxes[:, 3], 0, height)
+    return np.stack([x1, y1, x2 - x1, y2 - y1], axis=1)
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU of every box in `boxes_a` (rows) with every box in `boxes_b` (columns); boxes are x, y, w, h."""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, inter / union, 0.0)
+
+def nms_indices(boxes, scores, iou_threshold=0.7):
+    """
+    Greedy non-maximum suppression: keep the most confident box, drop every
+    remaining box overlapping it by IoU >= iou_threshold, repeat. Each step
+    is one vectorized IoU row. Returns kept indices, most confident first.
+    """
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+    keep = []
+    while len(order):
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        order = rest[iou_matrix(boxes[best], boxes[rest])[0] < iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+def nms(detections, iou_threshold=0.7):
+    """`nms_indices` applied to Detections."""
+    return detections[nms_indices(detections.boxes, detections.scores, iou_threshold)]
+
+def tile_grid(image_shape, tile_size, overlap):
+    """
+    (x, y, width, height) tiles of at most `tile_size` pixels covering an
+    image, neighbours overlapping by `overlap` pixels. The last row and
+    column are flush with the image edge rather than running past it.
+    """
+    height, width = image_shape[:2]
+    step = max(1, tile_size - overlap)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+    return [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+            for y in starts(height) for x in starts(width)]
+
+def _detect_tile(image, tile, detector, seam_margin=2):
+    """
+    Detect faces in one tile and return them in frame coordinates. Faces
+    touching a seam shared with another tile are dropped: with an overlap
+    wider than the face, the neighbouring tile sees the same face whole.
+    """
+    x, y, w, h = tile
+    height, width = image.shape[:2]
+    crop = np.ascontiguousarray(image[y:y + h, x:x + w])
+    faces = Detections.from_dicts(detector.detect_faces(crop)).clip(crop.shape)
+    x1, y1 = faces.boxes[:, 0], faces.boxes[:, 1]
+    x2, y2 = x1 + faces.boxes[:, 2], y1 + faces.boxes[:, 3]
+    cut = np.zeros(len(faces), dtype=bool)
+    if x > 0:
+        cut |= x1 <= seam_margin
+    if y > 0:
+        cut |= y1 <= seam_margin
+    if x + w < width:
+        cut |= x2 >= w - seam_margin
+    if y + h < height:
+        cut |= y2 >= h - seam_margin
+    return faces[~cut].shifted(x, y)
+
+def detect_tiled(image, min_confidence=0.95, tile_size=1024, overlap=160, workers=2,
+                 max_side=None, min_face_size=None, iou_threshold=0.5):
+    """
+    Detect faces at full resolution by running MTCNN over overlapping
+    tiles, plus one pass over the whole frame downscaled to `max_side`
+    (default `tile_size`) for faces too large for the overlap. Boxes are
+    translated to frame coordinates and duplicates from overlapping tiles
+    and the whole-frame pass are merged with NMS.
+
+    With `workers` > 1, tiles run on that many threads, each with its own
+    MTCNN instance (a few MB of weights per thread and process); with 1 they
+    run in order on the shared detector.
+    """
+    tiles = tile_grid(image.shape, tile_size, overlap)
+    if workers > 1:
+        parts = list(_tile_executor(workers).map(
+            lambda tile: _detect_tile(image, tile, _thread_detector(min_face_size)), tiles))
+    else:
+        detector = get_detector(min_face_size)
+        parts = [_detect_tile(image, tile, detector) for tile in tiles]
+    parts.append(detect(image, min_confidence=0.0, max_side=max_side or tile_size, min_face_size=min_face_size))
+    detections = Detections.concat(parts)
+    detections = detections[detections.scores >= min_confidence]
+    return nms(detections, iou_threshold).clip(image.shape)
+
+def detect(image, min_confidence=0.95, max_side=None, min_face_size=None,
+           tile_size=None, tile_overlap=160, tile_workers=2):
+    """
+    Run MTCNN and return the detections above `min_confidence` as Detections,
+    clipped to the image.
+
+    With `max_side`, images whose longer edge exceeds it are detected on a
+    downscaled copy and the boxes and keypoints are mapped back to `image`
+    coordinates, so detection cost stops growing with camera resolution
+    while crops can still be taken from the full-resolution pixels.
+    `min_face_size` is the smallest face MTCNN looks for, in pixels of the
+    image it actually runs on. With `tile_size`, images larger than one tile
+    go through `detect_tiled` instead, which keeps small faces that
+    downscaling would lose.
+    """
     # Assumes input image is in RGB.
-    faces = detector.detect_faces(image)
-    faces = [face for face in faces if face.get('confidence', 0) >= min_confidence]
-    return faces
+    height, width = image.shape[:2]
+    if tile_size and max(height, width) > tile_size:
+        return detect_tiled(image, min_confidence, tile_size=tile_size, overlap=tile_overlap,
+                            workers=tile_workers, max_side=max_side, min_face_size=min_face_size)
+    small = image
+    if max_side and max(height, width) > max_side:
+        small = resize_image(image, width=max_side) if width >= height else resize_image(image, height=max_side)
+    detections = Detections.from_dicts(get_detector(min_face_size).detect_faces(small))
+    detections = detections[detections.scores >= min_confidence]
+    if small is not image:
+        scale = np.array([width / small.shape[1], height / small.shape[0]], dtype=np.float32)
+        boxes = np.rint(detections.boxes.reshape(-1, 2, 2) * scale).reshape(-1, 4)
+        detections = Detections(boxes, detections.scores, detections.keypoints * scale)
+    return detections.clip(image.shape)
+
+def detect_faces(image, min_confidence=0.95):
+    """List-of-dicts form of `detect`, kept for existing callers."""
+    return detect(image, min_confidence).to_dicts()
 
 
 def iou(box1, box2):
@@ -34,31 +360,80 @@ def iou(box1, box2):
     return inter_area / union_area
 
 def nms_faces(detections, iou_threshold=0.7):
+    """`nms` for either Detections or a list of MTCNN dicts; returns the same form it was given."""
+    if isinstance(detections, Detections):
+        return nms(detections, iou_threshold)
     if not detections:
         return []
-    detections = sorted(detections, key=lambda x: x.get('confidence', 0), reverse=True)
-    nms = []
-    while detections:
-        best = detections.pop(0)
-        nms.append(best)
-        detections = [d for d in detections if iou(best['box'], d['box']) < iou_threshold]
-    return nms
-
-def extract_face(image, box, required_size=(160, 160)):
-    x, y, width, height = box
-    x, y = max(0, x), max(0, y)
-    face = image[y:y+height, x:x+width]
-    face = cv2.resize(face, required_size)
-    face = face.astype('float32')
-    mean, std = face.mean(), face.std()
-    face = (face - mean) / std
-    return face
+    keep = nms_indices([d['box'] for d in detections], [d.get('confidence', 0) for d in detections], iou_threshold)
+    return [detections[i] for i in keep]
+
+_crop_buffers = threading.local()
+
+def _buffer(name, shape, dtype):
+    """Per-thread scratch array of at least `shape`, reused across calls."""
+    buf = getattr(_crop_buffers, name, None)
+    if buf is None or buf.dtype != dtype or buf.shape[1:] != shape[1:] or buf.shape[0] < shape[0]:
+        buf = np.empty(shape, dtype=dtype)
+        setattr(_crop_buffers, name, buf)
+    return buf[:shape[0]]
+
+def extract_faces(image, boxes, required_size=FACE_SIZE, out=None):
+    """
+    Crop every box from `image`, resize to `required_size` and standardize
+    each crop (zero mean, unit std), writing straight into an
+    (N, height, width, 3) float32 tensor ready for `get_embeddings`.
+
+    Boxes are clipped to the frame; a box with no area inside it yields an
+    all-zero crop. Without `out` the result is a view of a per-thread buffer
+    that the next call on the same thread overwrites, so consume it (or
+    copy it) first.
+    """
+    boxes = clip_boxes(boxes, image.shape)
+    width, height = required_size
+    if out is None:
+        out = _buffer('crops', (len(boxes), height, width, 3), np.float32)
+    resized = _buffer('resized', (1, height, width, 3), image.dtype)[0]
+    square = _buffer('square', (1, height, width, 3), np.float32)[0]
+    for face, (x, y, w, h) in zip(out, boxes):
+        if w <= 0 or h <= 0:
+            face.fill(0)
+            continue
+        cv2.resize(image[y:y + h, x:x + w], required_size, dst=resized)
+        np.copyto(face, resized, casting='unsafe')
+        face -= face.mean()
+        std = np.sqrt(np.square(face, out=square).mean())
+        if std > 0:
+            face /= std
+    return out
+
+def extract_face(image, box, required_size=FACE_SIZE):
+    """Single-crop form of `extract_faces`; the returned array is the caller's own."""
+    width, height = required_size
+    return extract_faces(image, [box], required_size, out=np.empty((1, height, width, 3), dtype=np.float32))[0]
+
+def get_embeddings(faces, batch_size=32):
+    """
+    Embed face crops (an `extract_faces` tensor or a list of `extract_face`
+    crops) in as few FaceNet calls as possible. Crops are run as one NHWC
+    tensor `batch_size` at a time; each returned row is L2-normalized on its own.
+    """
+    if len(faces) == 0:
+        return np.zeros((0, EMBEDDING_DIM), dtype='float32')
+    # A tensor from `extract_faces` is used as is; a list of crops is stacked.
+    faces = faces if isinstance(faces, np.ndarray) and faces.ndim == 4 else np.stack(faces)
+    faces = faces.astype('float32', copy=False)
+    batch_size = min(batch_size, INFERENCE_BUCKETS[-1])
+    embeddings = np.concatenate([
+        _run_facenet(faces[start:start + batch_size])
+        for start in range(0, len(faces), batch_size)
+    ])
+    norms = norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
 
 def get_embedding(face_pixels):
-    face_pixels = np.expand_dims(face_pixels, axis=0)
-    embedding = facenet_model.predict(face_pixels)
-    embedding = embedding / norm(embedding)
-    return embedding[0]
+    return get_embeddings([face_pixels])[0]
 
 def cosine_similarity(emb1, emb2):
     return np.dot(emb1, emb2) / (norm(emb1) * norm(emb2))
@@ -0,0 +1,438 @@
+import threading
+import time
+
+import numpy as np
+
+# Embeddings are stored in `student_faces.embedding` as raw little-endian float32.
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+def encode_embedding(embedding):
+    """Serialize an embedding vector to the raw bytes stored in the database."""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(blob):
+    """Zero-copy view of a stored embedding as a float32 vector."""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize every row of a 2-D array and return it as float32.
+    Rows with zero norm are left as zeros instead of producing NaNs.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class CompactMatrix:
+    """
+    Matrix of normalized embeddings stored as float32, float16, or int8 with
+    one float32 scale per row (row = codes * scale). Indexing returns float32
+    rows; `dot` scores queries against the compact form in bounded chunks, so
+    only the compact copy stays resident.
+    """
+
+    STORAGES = ('float32', 'float16', 'int8')
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_float(cls, matrix, storage='float32'):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if storage == 'float32':
+            return cls(matrix)
+        if storage == 'float16':
+            return cls(matrix.astype(np.float16))
+        if storage == 'int8':
+            scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales[scales == 0] = 1.0
+            return cls(np.rint(matrix / scales[:, np.newaxis]).astype(np.int8), scales.astype(np.float32))
+        raise ValueError(f"Unknown gallery storage {storage!r}; expected one of {CompactMatrix.STORAGES}.")
+
+    @property
+    def storage(self):
+        return 'int8' if self.scales is not None else self.codes.dtype.name
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        rows = self.codes[idx].astype(np.float32, copy=False)
+        if self.scales is not None:
+            rows = rows * self.scales[idx][..., np.newaxis]
+        return rows
+
+    def take(self, idx):
+        return CompactMatrix(self.codes[idx], self.scales[idx] if self.scales is not None else None)
+
+    def append(self, other):
+        scales = np.concatenate([self.scales, other.scales]) if self.scales is not None else None
+        return CompactMatrix(np.concatenate([self.codes, other.codes]), scales)
+
+    def dot(self, queries, chunk=16384):
+        """Scores of float32 `queries` (rows) against every stored row (columns)."""
+        if self.storage == 'float32':
+            return queries @ self.codes.T
+        out = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), chunk):
+            out[:, start:start + chunk] = queries @ self[start:start + chunk].T
+        return out
+
+
+class MappedRows:
+    """
+    Read-only view of some rows of a (memory-mapped) float32 matrix. Rows
+    are gathered on indexing, so a partition gallery never copies its share
+    of the shared exact matrix into process memory.
+    """
+
+    def __init__(self, matrix, rows):
+        self.matrix = matrix
+        self.rows = np.asarray(rows, dtype=np.int64)
+
+    @property
+    def shape(self):
+        return (len(self.rows), self.matrix.shape[1])
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        return np.asarray(self.matrix[self.rows[idx]])
+
+
+class EmbeddingGallery:
+    """
+    In-memory gallery of enrollment embeddings.
+
+    All embeddings are kept as one pre-normalized matrix with a parallel
+    array of student ids, so every face in a photo can be scored against the
+    whole gallery with a single matrix multiply.
+
+    `storage` selects the resident form of that matrix (see CompactMatrix):
+    float16 halves and int8 quarters its memory. When `exact` float32 rows
+    are given (memory-mapped from a GalleryStore, so they live in the shared
+    page cache rather than in every process) the best compact candidates are
+    re-scored against them, so match decisions do not drift at the thresholds.
+
+    `index_factory`, when given, is called with the matrix and may return a
+    search index (see models.ann_index.IVFIndex) used by `search`/`match`
+    instead of the brute-force scan; returning None keeps the scan.
+
+    Without an index, `match` works in two stages: queries are scored
+    against one prototype per student (the renormalized mean of their
+    enrollment embeddings), and only the `shortlist` best students are
+    re-ranked against their individual embeddings. `shortlist=0` scores
+    every embedding directly.
+    """
+
+    # Compact-score candidates per query that are re-scored against the exact rows.
+    RERANK_DEPTH = 16
+
+    def __init__(self, student_ids, embeddings, dim=128, index_factory=None, index=None, shortlist=5,
+                 storage='float32', exact=None):
+        student_ids = np.asarray(student_ids)
+        # Fixed-width string ids (e.g. memory-mapped from a GalleryStore) are used as they are.
+        self.student_ids = student_ids if student_ids.dtype.kind == 'U' and len(student_ids) else student_ids.astype(object)
+        if isinstance(embeddings, CompactMatrix):
+            self.embeddings = embeddings
+        else:
+            matrix = normalize_rows(embeddings) if len(self.student_ids) else np.zeros((0, dim), dtype=np.float32)
+            self.embeddings = CompactMatrix.from_float(matrix, storage)
+        # float32 rows used to re-score compact candidates, or None.
+        self.exact = exact
+        self.index_factory = index_factory
+        if index is None and index_factory is not None and len(self.student_ids):
+            index = index_factory(self._exact_matrix())
+        self.index = index
+        self.shortlist = shortlist
+        self._prototypes = None
+
+    @classmethod
+    def from_rows(cls, rows, dim=128, **options):
+        """
+        Build a gallery from `student_faces` rows (dicts with 'student_id'
+        and a binary float32 'embedding' of `dim` values). `options` are
+        passed on to the constructor.
+        """
+        rows = [row for row in rows if row['embedding'] and len(row['embedding']) == dim * EMBEDDING_DTYPE.itemsize]
+        if not rows:
+            return cls([], [], dim=dim, **options)
+        matrix = decode_embedding(b"".join(row['embedding'] for row in rows)).reshape(-1, dim)
+        return cls([row['student_id'] for row in rows], matrix, dim=dim, **options)
+
+    def with_student(self, student_id, embeddings):
+        """Return a new gallery where `student_id` has exactly the given embeddings."""
+        keep = self.student_ids != student_id
+        dim = self.embeddings.shape[1]
+        embeddings = normalize_rows(embeddings) if len(embeddings) else np.zeros((0, dim), dtype=np.float32)
+        # The index is patched for the changed rows; None makes the new gallery rebuild it.
+        index = self.index.updated(keep, embeddings) if self.index is not None else None
+        return EmbeddingGallery(
+            np.concatenate([self.student_ids[keep], np.full(len(embeddings), student_id, dtype=object)]),
+            self.embeddings.take(keep).append(CompactMatrix.from_float(embeddings, self.embeddings.storage)),
+            dim=dim,
+            index_factory=self.index_factory,
+            index=index,
+            shortlist=self.shortlist,
+            exact=np.concatenate([self.exact[keep], embeddings]) if self.exact is not None else None,
+        )
+
+    def without_student(self, student_id):
+        """Return a new gallery with all embeddings of `student_id` removed."""
+        return self.with_student(student_id, [])
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes the gallery holds in process memory (compact matrix, exact rows
+        and prototypes). Memory-mapped exact rows are shared and not counted.
+        """
+        total = self.embeddings.nbytes
+        if self.exact is not None and not isinstance(self.exact, np.memmap):
+            total += self.exact.nbytes
+        if self._prototypes is not None:
+            total += self._prototypes[0].nbytes + self._prototypes[1].nbytes
+        return total
+
+    def _exact_matrix(self):
+        """The most precise rows available: the float32 copy if kept, else the compact matrix."""
+        return self.exact if self.exact is not None else self.embeddings
+
+    def scores(self, queries):
+        """Cosine similarity of every query (rows) against every gallery entry (columns), on the stored form."""
+        return self.embeddings.dot(normalize_rows(queries))
+
+    def top_k(self, queries, k=1):
+        """
+        Return (indices, scores) of the k best gallery entries for each query,
+        both of shape (len(queries), k) and sorted best first.
+        """
+        scores = self.scores(queries)
+        depth = max(k, self.RERANK_DEPTH) if self.exact is not None else k
+        depth = min(depth, scores.shape[1])
+        if depth < scores.shape[1]:
+            idx = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+        else:
+            idx = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        if self.exact is not None:
+            part = np.einsum('qcd,qd->qc', self.exact[idx], normalize_rows(queries))
+        else:
+            part = np.take_along_axis(scores, idx, axis=1)
+        order = np.argsort(-part, axis=1)[:, :min(k, scores.shape[1])]
+        return np.take_along_axis(idx, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+    def prototypes(self):
+        """
+        Per-student prototypes, computed once per gallery. Returns
+        (prototypes, members): a CompactMatrix of normalized mean embeddings
+        (same storage as the gallery) and an (S, m) array of each student's
+        row indices, padded with -1.
+        """
+        if self._prototypes is None:
+            _, inverse = np.unique(self.student_ids, return_inverse=True)
+            counts = np.bincount(inverse)
+            order = np.argsort(inverse, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            members = np.full((len(counts), counts.max()), -1, dtype=np.int64)
+            members[inverse[order], np.arange(len(order)) - starts[inverse[order]]] = order
+            sums = np.zeros((len(counts), self.embeddings.shape[1]), dtype=np.float32)
+            np.add.at(sums, inverse, self._exact_matrix()[:])
+            self._prototypes = (CompactMatrix.from_float(normalize_rows(sums), self.embeddings.storage), members)
+        return self._prototypes
+
+    def _two_stage(self, queries):
+        """Best (row index, score) per query via the prototype shortlist and a per-embedding re-rank."""
+        prototypes, members = self.prototypes()
+        k = min(self.shortlist, len(prototypes))
+        proto_scores = prototypes.dot(queries)
+        if k < len(prototypes):
+            shortlist = np.argpartition(-proto_scores, k - 1, axis=1)[:, :k]
+        else:
+            shortlist = np.tile(np.arange(len(prototypes)), (len(queries), 1))
+        candidates = members[shortlist].reshape(len(queries), -1)
+        valid = candidates >= 0
+        vectors = self._exact_matrix()[np.where(valid, candidates, 0)]
+        scores = np.einsum('qcd,qd->qc', vectors, queries)
+        scores[~valid] = -np.inf
+        best = np.argmax(scores, axis=1)
+        rows = np.arange(len(queries))
+        return candidates[rows, best][:, np.newaxis], scores[rows, best][:, np.newaxis]
+
+    def search(self, queries, k=1):
+        """
+        Like `top_k`, but through the search index when the gallery has one.
+        Index results may miss entries outside the probed lists.
+        """
+        if self.index is None:
+            return self.top_k(queries, k)
+        return self.index.search(self._exact_matrix(), normalize_rows(queries), k)
+
+    def match(self, queries, threshold):
+        """
+        Match each query embedding to its closest student.
+        Returns a list of (student_id, score) pairs; student_id is None when
+        the best score does not exceed the threshold or the gallery is empty.
+        """
+        queries = np.asarray(queries)
+        if len(queries) == 0:
+            return []
+        if len(self) == 0:
+            return [(None, -1.0) for _ in range(len(queries))]
+        if self.index is None and self.shortlist:
+            best, best_scores = self._two_stage(normalize_rows(queries))
+        else:
+            best, best_scores = self.search(queries, k=1)
+        return [
+            (str(self.student_ids[i]) if i >= 0 and s > threshold else None, float(s) if i >= 0 else -1.0)
+            for i, s in zip(best[:, 0], best_scores[:, 0])
+        ]
+
+
+class GalleryCache:
+    """
+    Process-level cache of enrollment galleries.
+
+    Galleries are loaded through `loader(scope)` and then patched in place
+    whenever enrollment changes, so recognition requests never scan
+    `student_faces`. `scope` is None for the whole institution or a
+    (branch, class) pair for one partition; each scope is loaded on first
+    use. Galleries are immutable; updates swap in new objects and bump
+    `version`, so readers holding an old one are never affected.
+
+    With a `store` (see models.gallery_store.GalleryStore) the galleries are
+    shared between processes instead: enrollment changes rebuild the store,
+    and every process drops its galleries once the store's version moves on.
+
+    Without a store, a `counter` (with `current()` and `bump()`, e.g. a
+    database row) keeps several processes in step: every update bumps it, and
+    a process that sees it move on by someone else's write, checked at most
+    every `check_interval` seconds, reloads its galleries.
+    """
+
+    def __init__(self, loader, store=None, counter=None, check_interval=1.0):
+        self._loader = loader
+        self._store = store
+        self._counter = counter
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._galleries = {}
+        self._store_version = None
+        self._counter_version = None
+        self._checked_at = 0.0
+        self.version = 0
+
+    def get(self, scope=None):
+        if self._store is not None:
+            store_version = self._store.current_version()
+            if store_version != self._store_version:
+                with self._lock:
+                    if store_version != self._store_version:
+                        self._galleries = {}
+                        self._store_version = store_version
+                        self.version += 1
+        elif self._counter is not None:
+            self._check_counter()
+        gallery = self._galleries.get(scope)
+        if gallery is None:
+            with self._lock:
+                if scope not in self._galleries:
+                    self._galleries[scope] = self._loader(scope)
+                gallery = self._galleries[scope]
+        return gallery
+
+    def _check_counter(self):
+        """Counter mode: drop every gallery once another process has changed enrollment."""
+        now = time.monotonic()
+        if now - self._checked_at < self._check_interval:
+            return
+        self._checked_at = now
+        counter_version = self._counter.current()
+        if counter_version != self._counter_version:
+            with self._lock:
+                self._galleries = {}
+                self._counter_version = counter_version
+                self.version += 1
+
+    def _announce(self):
+        """
+        Counter mode: bump the shared counter after this process patched its
+        own galleries. When nobody else wrote since our last check, the new
+        value is adopted; otherwise the next `get` reloads.
+        """
+        if self._counter is None:
+            return
+        seen = self._counter_version
+        counter_version = self._counter.bump()
+        with self._lock:
+            if seen is not None and self._counter_version == seen and counter_version == seen + 1:
+                self._counter_version = counter_version
+
+    def _publish(self):
+        """Store mode: rebuild the shared files; this and every other process reload on their next get."""
+        self._store.rebuild()
+
+    def invalidate_partitions(self):
+        """Drop the per-partition galleries (e.g. after a student changed class), keeping the full one."""
+        if self._store is not None:
+            return self._publish()
+        with self._lock:
+            self._galleries = {None: self._galleries[None]} if None in self._galleries else {}
+            self.version += 1
+        self._announce()
+
+    def replace_student(self, student_id, embeddings, scope=None):
+        """
+        Write-through update after a student's enrollment embeddings were
+        (re)written. `scope` is the student's (branch, class); partitions are
+        dropped for reload when it is not given.
+        """
+        if self._store is not None:
+            return self._publish()
+        with self._lock:
+            galleries = {}
+            for key, gallery in self._galleries.items():
+                if key is None or (scope is not None and _in_scope(scope, key)):
+                    galleries[key] = gallery.with_student(student_id, embeddings)
+                elif scope is not None:
+                    galleries[key] = gallery.without_student(student_id)
+            self._galleries = galleries
+            self.version += 1
+        self._announce()
+
+    def remove_student(self, student_id):
+        if self._store is not None:
+            return self._publish()
+        with self._lock:
+            self._galleries = {key: gallery.without_student(student_id)
+                               for key, gallery in self._galleries.items()}
+            self.version += 1
+        self._announce()
+
+
+def _in_scope(student_scope, key):
+    """Whether a student in (branch, class) `student_scope` belongs to partition `key` (None = any)."""
+    return all(want is None or want == have for want, have in zip(key, student_scope))
@@ -0,0 +1,173 @@
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from models.ann_index import IVFIndex
+from models.gallery import CompactMatrix, EmbeddingGallery, MappedRows, decode_embedding, normalize_rows
+
+try:
+    import fcntl
+except ImportError:  # Windows: rebuilds in one process are still serialized by the thread lock.
+    fcntl = None
+
+
+class GalleryStore:
+    """
+    Versioned gallery files shared by every worker process on a host.
+
+    Each version is a directory of .npy arrays: the student id table, the
+    branch/class columns for partition galleries, the embedding matrix in
+    the configured storage, optional float32 copies for re-ranking and,
+    when `index_factory` returns one, the IVF centroids and list assignments,
+    so k-means runs once per version instead of once per worker.
+    Workers map the arrays read-only, so the pages live once in the OS page
+    cache instead of once per process. `rebuild` writes a new version next
+    to the old one and publishes it by atomically replacing the CURRENT
+    pointer file. Readers poll CURRENT at most every `check_interval`
+    seconds and remap when it changes.
+    """
+
+    def __init__(self, directory, rows_loader, dim=128, storage='float32', rerank=False,
+                 check_interval=1.0, keep_versions=3, index_factory=None):
+        self.directory = directory
+        self._rows_loader = rows_loader
+        self.index_factory = index_factory
+        self.dim = dim
+        self.storage = storage
+        self.rerank = rerank
+        self.check_interval = check_interval
+        self.keep_versions = keep_versions
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._version = None
+        self._arrays = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _pointer(self):
+        return os.path.join(self.directory, 'CURRENT')
+
+    def _read_pointer(self):
+        try:
+            with open(self._pointer()) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current_version(self):
+        """Published version name (re-read at most every check_interval seconds); builds the first one if missing."""
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.check_interval:
+            version = self._read_pointer()
+            if version is None:
+                version = self.rebuild(only_if_missing=True)
+            self._version, self._checked_at = version, now
+        return self._version
+
+    def rebuild(self, only_if_missing=False):
+        """
+        Materialize the gallery from `rows_loader()` as a new version and
+        publish it. Concurrent rebuilds (threads or processes) are serialized
+        by a lock file. Returns the published version name.
+        """
+        with self._lock, open(os.path.join(self.directory, 'rebuild.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            current = self._read_pointer()
+            if only_if_missing and current is not None:
+                return current
+            # Number after the highest version on disk, not after CURRENT: a rebuild that died
+            # between the rename and the pointer swap leaves an unpublished directory behind.
+            version = f"v{self._latest_number() + 1:08d}"
+            tmp_dir = os.path.join(self.directory, version + '.tmp')
+            target = os.path.join(self.directory, version)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            self._write(tmp_dir, self._rows_loader())
+            shutil.rmtree(target, ignore_errors=True)
+            os.rename(tmp_dir, target)
+            tmp_pointer = self._pointer() + '.tmp'
+            with open(tmp_pointer, 'w') as f:
+                f.write(version)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_pointer, self._pointer())
+            self._prune(version)
+            self._version, self._checked_at = version, time.monotonic()
+            return version
+
+    def _latest_number(self):
+        numbers = [int(name[1:].split('.')[0]) for name in os.listdir(self.directory)
+                   if name.startswith('v') and name[1:].split('.')[0].isdigit()]
+        current = self._read_pointer()
+        if current and current[1:].isdigit():
+            numbers.append(int(current[1:]))
+        return max(numbers, default=0)
+
+    def _write(self, path, rows):
+        rows = [row for row in rows if row['embedding'] and len(row['embedding']) == self.dim * 4]
+        matrix = (normalize_rows(decode_embedding(b"".join(row['embedding'] for row in rows)).reshape(-1, self.dim))
+                  if rows else np.zeros((0, self.dim), dtype=np.float32))
+        compact = CompactMatrix.from_float(matrix, self.storage)
+        arrays = {
+            'student_ids': np.array([row['student_id'] for row in rows], dtype=str),
+            'branch': np.array([row['branch'] or '' for row in rows], dtype=str),
+            'class': np.array([row['class'] or '' for row in rows], dtype=str),
+            'codes': compact.codes,
+        }
+        if compact.scales is not None:
+            arrays['scales'] = compact.scales
+        if self.rerank and self.storage != 'float32':
+            arrays['exact'] = matrix
+        index = self.index_factory(matrix) if self.index_factory is not None and len(matrix) else None
+        if index is not None:
+            arrays['ivf_centroids'] = index.centroids
+            arrays['ivf_assignments'] = index.assignments
+            arrays['ivf_nprobe'] = np.array(index.nprobe)
+        for name, array in arrays.items():
+            with open(os.path.join(path, name + '.npy'), 'wb') as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _prune(self, current):
+        versions = sorted(name for name in os.listdir(self.directory)
+                          if name.startswith('v') and not name.endswith('.tmp') and name != current)
+        for name in versions[:max(0, len(versions) - self.keep_versions + 1)]:
+            # Mapped files stay valid for readers after unlink on POSIX; elsewhere removal may fail and is retried later.
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def arrays(self, version):
+        """Read-only memory maps of one version's arrays (cached for the latest version used)."""
+        arrays = self._arrays
+        if arrays is None or arrays[0] != version:
+            path = os.path.join(self.directory, version)
+            maps = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                    for name in os.listdir(path) if name.endswith('.npy')}
+            arrays = self._arrays = (version, maps)
+        return arrays[1]
+
+    def gallery(self, scope=None, **options):
+        """
+        Gallery for a scope from the current version. The institution-wide
+        gallery wraps the maps without copying; a (branch, class) partition
+        copies just its own compact rows and reads exact rows through the map.
+        A stored IVF index is reused as is, restricted to the partition's rows.
+        """
+        maps = self.arrays(self.current_version())
+        compact = CompactMatrix(maps['codes'], maps.get('scales'))
+        student_ids, exact = maps['student_ids'], maps.get('exact')
+        assignments = maps.get('ivf_assignments')
+        if scope is not None:
+            mask = np.ones(len(student_ids), dtype=bool)
+            for column, value in zip(('branch', 'class'), scope):
+                if value is not None:
+                    mask &= maps[column] == value
+            compact, student_ids = compact.take(mask), student_ids[mask]
+            exact = MappedRows(exact, np.flatnonzero(mask)) if exact is not None else None
+            assignments = assignments[mask] if assignments is not None else None
+        if assignments is not None and len(assignments):
+            options['index'] = IVFIndex(maps['ivf_centroids'], assignments, nprobe=int(maps['ivf_nprobe']))
+        return EmbeddingGallery(student_ids, compact, dim=self.dim, exact=exact, **options)
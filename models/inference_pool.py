@@ -0,0 +1,107 @@
+import concurrent.futures
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from models.face_recognition import detect, extract_faces, get_embeddings, warm_up
+
+
+def _init_worker(warm, min_face_size):
+    if warm:
+        warm_up(min_face_size)
+
+
+def _ping():
+    return True
+
+
+def detect_and_embed(image, min_confidence, batch_size, embed_image=None, **detect_options):
+    """
+    Detect faces in `image` and embed every one of them in a single batch.
+    `detect_options` (max_side, min_face_size, tile_size, ...) are passed to
+    `detect`. Crops are taken from `embed_image` when given (e.g. a filtered
+    copy of the same frame), always at full resolution even when detection
+    ran on a downscaled copy. Returns (faces, embeddings) where faces is a
+    Detections in full-resolution coordinates and embeddings an (N, 128) array.
+    """
+    faces = detect(image, min_confidence=min_confidence, **detect_options)
+    source = image if embed_image is None else embed_image
+    embeddings = get_embeddings(extract_faces(source, faces.boxes), batch_size=batch_size)
+    return faces, embeddings
+
+
+class InferencePool:
+    """
+    Long-lived pool of inference worker processes.
+
+    Each worker holds its own warm MTCNN detector and FaceNet model, so
+    requests from several teachers run on separate cores instead of sharing
+    one model behind the GIL. At most `queue_depth` tasks may be queued or
+    running at once; further submits block until a slot frees up, so a busy
+    pool delays callers rather than rejecting them. With `workers=0` tasks run
+    inline in the calling thread. `min_face_size` selects the MTCNN detector
+    the workers warm up.
+    """
+
+    def __init__(self, workers=2, queue_depth=64, warm=True, min_face_size=None):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.warm = warm
+        self.min_face_size = min_face_size
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.ready = False
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork a process that may already hold TensorFlow threads.
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.warm, self.min_face_size),
+                )
+            return self._executor
+
+    def _reset_executor(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False)
+
+    def start(self):
+        """Start every worker and wait until each has loaded and warmed its models."""
+        if self.workers > 0:
+            executor = self._get_executor()
+            concurrent.futures.wait([executor.submit(_ping) for _ in range(self.workers)])
+        elif self.warm:
+            warm_up(self.min_face_size)
+        self.ready = True
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            if self.workers == 0:
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(fn, *args, **kwargs)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM); replace the pool and retry once.
+                    self._reset_executor(executor)
+                    future = self._get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def detect_and_embed(self, image, min_confidence, batch_size, embed_image=None, **detect_options):
+        return self.submit(detect_and_embed, image, min_confidence, batch_size, embed_image, **detect_options)
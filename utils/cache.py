@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+class ReportCache:
+    """
+    Thread-safe LRU cache with a TTL for report query results.
+
+    Every entry is stored with the (start_date, end_date) range it covers, so
+    a write to attendance on some date can drop exactly the entries whose
+    range contains it. The cache is per process: invalidation made by another
+    worker is not seen here, which is what `ttl` bounds.
+
+    A miss queries the database and then stores the result. To keep a write
+    that lands in between from being overwritten by the older result, take
+    `generation()` before the query and pass it to `put`: the result is not
+    stored if any date of its range was invalidated since.
+    """
+
+    # Invalidated dates remembered for `put`; beyond this, older generations are refused wholesale.
+    MAX_TRACKED_DATES = 1024
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._generation = 0
+        self._invalidated = {}   # ISO date -> generation of its last invalidation
+        self._cleared_at = 0
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss or an expired entry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[3]
+
+    def generation(self):
+        """Token to take before querying; see `put`."""
+        with self._lock:
+            return self._generation
+
+    def _stale(self, start, end, generation):
+        if generation < self._cleared_at:
+            return True
+        return any(start <= d <= end for d, g in self._invalidated.items() if g > generation)
+
+    def put(self, key, start_date, end_date, value, generation=None):
+        """Store `value`, unless `generation` is given and its range was invalidated after it was taken."""
+        if self.maxsize <= 0:
+            return
+        start, end = _iso(start_date), _iso(end_date)
+        with self._lock:
+            if generation is not None and self._stale(start, end, generation):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, start, end, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_dates(self, dates):
+        """Drop every entry whose date range contains one of `dates`."""
+        dates = [_iso(d) for d in dates if d]
+        if not dates:
+            return
+        with self._lock:
+            self._generation += 1
+            for d in dates:
+                self._invalidated[d] = self._generation
+            if len(self._invalidated) > self.MAX_TRACKED_DATES:
+                self._invalidated.clear()
+                self._cleared_at = self._generation
+            stale = [key for key, (_, start, end, _) in self._entries.items()
+                     if any(start <= d <= end for d in dates)]
+            for key in stale:
+                del self._entries[key]
+            self._invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._invalidated.clear()
+            self._cleared_at = self._generation
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else None,
+                'invalidations': self._invalidations,
+            }
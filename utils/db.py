@@ -0,0 +1,172 @@
+import os
+import queue
+import threading
+import time
+
+import mysql.connector
+
+
+class PoolTimeout(mysql.connector.Error):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+
+class PooledConnection:
+    """
+    Wrapper around a pooled MySQL connection. It behaves like the underlying
+    connection, but close() (or leaving a `with` block) hands it back to the
+    pool instead of closing the socket.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # Safety net for code paths that forget to close: return the connection anyway.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Fixed-size, thread-safe pool of MySQL connections.
+
+    Connections are opened on demand up to `size`. Callers beyond that wait up
+    to `timeout` seconds and then get PoolTimeout. A connection that has been
+    idle longer than `health_check_interval` is pinged (and reconnected if the
+    server dropped it) before being handed out.
+    """
+
+    def __init__(self, size=10, timeout=10, health_check_interval=30, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._connect_args = connect_args
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._in_use = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._reconnects = 0
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self._connect_args)
+        conn.autocommit = True
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share sockets with a parent process after fork.
+                self._reset_state()
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    self._waits += 1
+                    create = False
+        if conn is None:
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+                idle_since = time.monotonic()
+            else:
+                try:
+                    conn, idle_since = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(msg="Timed out waiting for a database connection.")
+        if time.monotonic() - idle_since > self.health_check_interval:
+            conn = self._check(conn)
+        with self._lock:
+            self._in_use += 1
+        return PooledConnection(self, conn)
+
+    def _check(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except mysql.connector.Error:
+            with self._lock:
+                self._reconnects += 1
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+    def release(self, conn):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._in_use -= 1
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            if conn.in_transaction:
+                conn.rollback()
+            conn.autocommit = True
+        except mysql.connector.Error:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+            }